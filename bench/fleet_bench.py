@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+# Copyright 2012 Joshua Heling <jrh@netfluvia.org>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Throughput benchmark for pybotz against a simulated fleet of Netbotz hosts.
+
+Each simulated host is a local HTTP server (run in a separate process, so it
+doesn't pollute the client's CPU and memory figures) serving the recorded
+pages in pages/:
+
+  /pages/menu_noscript.html           - lists the host's modules
+  /pages/status.html?encid=<module>   - the recorded status page, with its
+                                        numeric readings drifting over time
+
+The sensor configuration is held in an in-memory SQLite database standing in
+for the MySQL config db.  The benchmark times get_sensor_modules(),
+scrape_sensor_module(), CheckerPool construction and a number of
+CheckerPool.check() sweeps, and reports sweep time, readings/sec, CPU per
+reading and peak memory.
+
+Example:
+  python bench/fleet_bench.py --hosts 20 --modules 4 --latency 50 --concurrency 16
+"""
+
+import os
+import sys
+import re
+import time
+import random
+import httplib
+import sqlite3
+import zlib
+import argparse
+import resource
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pybotz
+
+PAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+_NUMERIC_LINK = re.compile(r"(<a\b[^>]*>)(\d+\.?\d*)")
+_MENU_MODULE = re.compile(r"""<tr><td><a href="status.html\?encid=(?!nbSensorSet_Alerting)[^"]*" target="sensor">[^<]*</a></td></tr>\n""")
+
+class SimulatedModule:
+  """Status page for one module: the recorded page with drifting numeric values."""
+
+  _pieces = None
+  """Recorded page split around its numeric readings (text, value, text, value, ..., text)."""
+
+  _values = None
+  _drift = None
+
+  def __init__(self, recorded, drift):
+    parts = _NUMERIC_LINK.split(recorded)
+    ## split() gives text, link open tag, value, text, ...; fold the tags back into the text
+    self._pieces = [parts[0]]
+    self._values = []
+    for i in range(1, len(parts), 3):
+      self._pieces[-1] += parts[i]
+      self._values.append(float(parts[i + 1]))
+      self._pieces.append(parts[i + 2])
+    self._drift = drift
+
+  def page(self):
+    """Return the page, first letting each value drift with probability drift."""
+    out = [self._pieces[0]]
+    for (i, v) in enumerate(self._values):
+      if self._drift and random.random() < self._drift:
+        self._values[i] = v = round(v + random.gauss(0, 1), 1)
+      out.append(str(v))
+      out.append(self._pieces[i + 1])
+    return "".join(out)
+
+def _module_names(host_index, modules):
+  return ["nbSensorPod_%04X%04X" % (host_index, m) for m in range(modules)]
+
+def _serve_host(host_index, modules, latency, drop_rate, drift, ready):
+  """Run one simulated host until killed; report its port through ready."""
+  recorded_status = open(os.path.join(PAGE_DIR, "status.html")).read()
+  recorded_menu = open(os.path.join(PAGE_DIR, "menu_noscript.html")).read()
+  names = _module_names(host_index, modules)
+
+  anchors = "".join(['<tr><td><a href="status.html?encid=%s" target="sensor">%s</a></td></tr>\n' % (n, n)
+                     for n in names])
+  menu = _MENU_MODULE.sub("", recorded_menu)
+  menu = menu.replace('target="sensor">Alerting Sensors</a></td></tr>\n',
+                      'target="sensor">Alerting Sensors</a></td></tr>\n' + anchors, 1)
+  pages = dict([(n, SimulatedModule(recorded_status, drift)) for n in names])
+
+  class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+      pass
+
+    def do_GET(self):
+      if latency:
+        time.sleep(latency)
+      if drop_rate and random.random() < drop_rate:
+        self.close_connection = 1
+        return
+      m = re.match(r"/pages/status.html\?encid=(.+)", self.path)
+      if self.path == "/pages/menu_noscript.html":
+        body = menu
+      elif m and m.group(1) in pages:
+        body = pages[m.group(1)].page()
+      else:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header("Content-Type", "text/html")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+  server = Server(("127.0.0.1", 0), Handler)
+  ready.put(server.server_address[1])
+  server.serve_forever()
+
+class SimulatedFleet:
+  """A set of simulated hosts, each served from its own process."""
+
+  _procs = None
+  ports = None
+
+  def __init__(self, hosts, modules, latency=0, drop_rate=0, drift=0):
+    """Start the fleet.
+
+    Arguments:
+    hosts -- number of netbotz hosts
+    modules -- sensor modules per host
+    latency -- seconds each response is delayed
+    drop_rate -- fraction of requests answered by dropping the connection
+    drift -- probability that each numeric reading changes between requests
+    """
+    self._procs = []
+    self.ports = []
+    ready = multiprocessing.Queue()
+    for h in range(hosts):
+      p = multiprocessing.Process(target=_serve_host, args=(h, modules, latency, drop_rate, drift, ready))
+      p.daemon = True
+      p.start()
+      self._procs.append(p)
+      self.ports.append(ready.get())
+
+  def stop(self):
+    for p in self._procs:
+      p.terminate()
+
+class SQLiteConfigDB:
+  """Minimal stand-in for a MySQLdb connection to the sensordata schema, backed by SQLite."""
+
+  class Cursor:
+    def __init__(self, cursor):
+      self._c = cursor
+      self.rowcount = 0
+      self._rows = []
+
+    def execute(self, query, args=()):
+      if not isinstance(args, (tuple, list)):
+        args = (args,)
+      self._c.execute(self._translate(query), args)
+      self._rows = self._c.fetchall()
+      self.rowcount = len(self._rows) if self._c.description else self._c.rowcount
+      self.lastrowid = self._c.lastrowid
+
+    def executemany(self, query, seq):
+      self._c.executemany(self._translate(query), seq)
+      self.rowcount = self._c.rowcount
+
+    def fetchall(self):
+      (rows, self._rows) = (self._rows, [])
+      return rows
+
+    def fetchone(self):
+      if self._rows:
+        return self._rows.pop(0)
+      return None
+
+    def close(self):
+      self._c.close()
+
+    def _translate(self, query):
+      return query.replace("%s", "?").replace("TRUE", "1").replace("FALSE", "0")
+
+  def __init__(self):
+    self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+    ## MySQL functions used by pybotz.config_fingerprint()
+    self._conn.create_function("CRC32", 1, lambda s: zlib.crc32(s.encode("utf-8")) & 0xffffffff)
+    self._conn.create_function("CONCAT_WS", -1,
+                               lambda sep, *args: sep.join([unicode(a) for a in args if a is not None]))
+    self._conn.executescript("""
+      CREATE TABLE host (id INTEGER PRIMARY KEY, address TEXT NOT NULL);
+      CREATE TABLE sensor_module (id INTEGER PRIMARY KEY, host INT NOT NULL, module_name TEXT NOT NULL,
+                                  track_data INT NOT NULL DEFAULT 1, display_name TEXT);
+      CREATE TABLE sensor (id INTEGER PRIMARY KEY, module INT NOT NULL, sensor_name TEXT NOT NULL, units TEXT,
+                           track_data INT NOT NULL DEFAULT 1, poll_interval INT, alert_threshold REAL,
+                           adaptive_interval INT NOT NULL DEFAULT 0);
+    """)
+
+  def cursor(self):
+    return SQLiteConfigDB.Cursor(self._conn.cursor())
+
+  def commit(self):
+    self._conn.commit()
+
+  def close(self):
+    self._conn.close()
+
+def _cpu():
+  r = resource.getrusage(resource.RUSAGE_SELF)
+  return r.ru_utime + r.ru_stime
+
+def _report(label, elapsed, cpu, readings):
+  line = "%-28s %9.3f s" % (label, elapsed)
+  if readings:
+    line += "  %10.0f readings/s  %8.1f us cpu/reading" % (readings / elapsed, cpu / readings * 1e6)
+  print line
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark pybotz against a simulated Netbotz fleet.")
+  parser.add_argument("--hosts", type=int, default=10)
+  parser.add_argument("--modules", type=int, default=4, help="sensor modules per host")
+  parser.add_argument("--latency", type=float, default=20, help="per-response latency (ms)")
+  parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of requests dropped")
+  parser.add_argument("--drift", type=float, default=0.1, help="chance each value changes per request")
+  parser.add_argument("--sweeps", type=int, default=5)
+  parser.add_argument("--concurrency", type=int, default=pybotz.config['max_concurrency'])
+  parser.add_argument("--per-host", type=int, default=pybotz.config['max_per_host'])
+  parser.add_argument("--parser", default=pybotz.config['parser'], choices=["fast", "soup"])
+  args = parser.parse_args(argv)
+
+  pybotz.config['parser'] = args.parser
+  fleet = SimulatedFleet(args.hosts, args.modules, args.latency / 1000.0, args.drop_rate, args.drift)
+  try:
+    hosts = ["http://127.0.0.1:%d" % port for port in fleet.ports]
+    recorded = open(os.path.join(PAGE_DIR, "status.html")).read()
+    rows_per_page = len(pybotz.parse_status_page(recorded, None))
+
+    print "%d hosts x %d modules x %d sensors, %.0f ms latency, %.0f%% dropped, %s parser, concurrency %d/%d" % \
+      (args.hosts, args.modules, rows_per_page, args.latency, args.drop_rate * 100, args.parser,
+       args.concurrency, args.per_host)
+
+    start = (time.time(), _cpu())
+    inventory = []
+    for host in hosts:
+      for attempt in range(10):            ## the simulated drop rate applies here too
+        try:
+          inventory.append((host, pybotz.get_sensor_modules(host)))
+          break
+        except (IOError, httplib.HTTPException):
+          continue
+      else:
+        raise IOError("Could not list modules on %s" % host)
+    _report("get_sensor_modules()", time.time() - start[0], _cpu() - start[1], 0)
+
+    start = (time.time(), _cpu())
+    scraped = 0
+    for (host, modules) in inventory:
+      for m in modules:
+        try:
+          scraped += len(pybotz.scrape_sensor_module(host, m))
+        except (IOError, httplib.HTTPException):
+          pass
+    _report("scrape_sensor_module()", time.time() - start[0], _cpu() - start[1], scraped)
+
+    dbh = SQLiteConfigDB()
+    c = dbh.cursor()
+    sensor_names = [r.key() for r in pybotz.parse_status_page(recorded, None)]
+    for (h, (host, modules)) in enumerate(inventory):
+      c.execute("INSERT INTO host (id, address) VALUES (%s, %s)", (h + 1, host[len("http://"):]))
+      for m in modules:
+        c.execute("INSERT INTO sensor_module (host, module_name, display_name) VALUES (%s, %s, %s)",
+                  (h + 1, m, m))
+        module_id = c.lastrowid
+        c.executemany("INSERT INTO sensor (module, sensor_name) VALUES (%s, %s)",
+                      [(module_id, n) for n in sensor_names])
+    dbh.commit()
+
+    start = (time.time(), _cpu())
+    pool = pybotz.CheckerPool(dbh, args.concurrency, args.per_host)
+    _report("CheckerPool()", time.time() - start[0], _cpu() - start[1], 0)
+
+    sweep_times = []
+    for n in range(args.sweeps):
+      start = (time.time(), _cpu())
+      alerts = pool.check()
+      elapsed = time.time() - start[0]
+      sweep_times.append(elapsed)
+      _report("CheckerPool.check() #%d" % (n + 1), elapsed, _cpu() - start[1],
+              args.hosts * args.modules * rows_per_page)
+
+    print "%-28s %9.3f s (min %.3f, max %.3f)" % ("mean sweep", sum(sweep_times) / len(sweep_times),
+                                                  min(sweep_times), max(sweep_times))
+    print "%-28s %9.1f MB" % ("peak memory", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+  finally:
+    fleet.stop()
+
+if __name__ == "__main__":
+  main()
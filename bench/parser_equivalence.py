@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+# Copyright 2012 Joshua Heling <jrh@netfluvia.org>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Checks that the 'fast' and 'soup' status page parsers agree on recorded pages.
+
+For every page, the sensortable rows extracted by the precompiled patterns
+(pybotz._sensor_rows_fast()) must be identical to those BeautifulSoup
+extracts (pybotz._sensor_rows_soup()), unless the patterns decline the page
+(returning None, so that BeautifulSoup repairs it), and parse_status_page()
+must produce the same readings with either parser.  The corpus is 
+pages/status.html and pages/corpus/*.html; add any page that trips up a 
+parser there.
+
+Exits with status 1 if any page differs.
+
+Example:
+  python bench/parser_equivalence.py
+  python bench/parser_equivalence.py /tmp/captured/*.html
+"""
+
+import os
+import sys
+import glob
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pybotz
+
+PAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+def corpus():
+  """Return the paths of the recorded status pages."""
+  return [os.path.join(PAGE_DIR, "status.html")] + sorted(glob.glob(os.path.join(PAGE_DIR, "corpus", "*.html")))
+
+def _readings(html, parser):
+  """Return (key, value, condition) for each reading parse_status_page() finds, or the error it raises."""
+  try:
+    readings = pybotz.parse_status_page(html, datetime(2012, 1, 1), "m-", parser)
+  except ValueError, e:
+    return "ValueError: %s" % e
+  return [(r.key(), r.value(), r.condition()) for r in readings]
+
+def compare(path):
+  """Return a list of differences between the parsers on the page at path (empty if they agree)."""
+  f = open(path)
+  try:
+    html = f.read()
+  finally:
+    f.close()
+  differences = []
+  fast = pybotz._sensor_rows_fast(html)
+  soup = pybotz._sensor_rows_soup(html)
+  if fast is not None and fast != soup:
+    differences.append("rows: fast %r, soup %r" % (fast, soup))
+  fast = _readings(html, 'fast')
+  soup = _readings(html, 'soup')
+  if fast != soup:
+    differences.append("readings: fast %r, soup %r" % (fast, soup))
+  return differences
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Check that pybotz's status page parsers agree.")
+  parser.add_argument("pages", nargs="*", help="pages to check (default: the recorded corpus)")
+  args = parser.parse_args(argv)
+
+  failed = 0
+  for path in args.pages or corpus():
+    differences = compare(path)
+    if differences:
+      failed += 1
+      print "DIFFERS %s" % path
+      for d in differences:
+        print "  %s" % d
+    else:
+      print "ok      %s" % path
+  return failed and 1 or 0
+
+if __name__ == "__main__":
+  sys.exit(main())
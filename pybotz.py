@@ -19,16 +19,48 @@ of APC's Netbotz 500 monitoring hardware[1].
 
 Classes
 --------
+ArchiveReader - reads and replays pages recorded by an ArchiveWriter
+ArchiveWriter - compact, indexed, append-only archive of retrieved status pages
+BatchEvaluator - vectorized threshold/change evaluation for a whole sweep
 CheckerPool - simple pool of SensorModuleCheckers
+Checkpoint - memory-mapped view of a saved sensor state file for warm restarts
+CircuitBreaker - stops polling a netbotz host while it is unreachable
+Deadline - connect, read and total time budgets for an HTTP request
+FleetDiscovery - finds new modules and sensors across many hosts and adds them to the db
+GraphiteSink - batched output of readings to Graphite's plaintext protocol
+HostConnectionPool - persistent HTTP connections shared by a host's modules
+JSONLinesSink - batched output of readings as JSON lines to a file or socket
+LatencyHistogram - fixed-bucket histogram of durations with percentiles
+LatestValueIndex - in-memory index of the latest reading of every sensor
+LatestValueServer - read-only HTTP/JSON endpoint serving a LatestValueIndex
+MySQLReadingSink - batched write-behind storage of readings in MySQL
+PipelinedPoller - fetch, parse and evaluate stages connected by bounded queues
+PollingDaemon - long-running poller that sleeps until the next sensor is due
+ReadingSink - base class for buffered, write-behind reading outputs
+Scheduler - polls a CheckerPool's modules only when their sensors are due
 SensorChecker - logic and state related to a single sensor
+SensorHistory - compact ring buffer of a sensor's recent readings
 SensorModuleChecker - performance-oriented grouping of sensors to common 
                       network hosts
 SensorReading - complex data type for data read from a sensor
+ShardedCheckerPool - polls the sensor config from several worker processes
+StatsdSink - batched output of readings to StatsD as gauges over UDP
+StreamReadingSink - base class for line-oriented outputs to a socket or file
 
 Functions
 --------
+config_fingerprint() - cheap checksum of the sensor config, to detect changes
+get_archive_writer() - get this process's ArchiveWriter for an archive file
+get_circuit_breaker() - get the shared CircuitBreaker for a netbotz host
+get_connection_pool() - get the shared HostConnectionPool for a netbotz host
 get_sensor_modules() - identify all modules on a given netbotz host
+load_config_snapshot() - read a sensor config saved by save_config_snapshot()
+load_pool_config() - read the tracked host/module/sensor config from the db
+main() - run the poller as a daemon (see --help)
+parse_status_page() - get all readings from a sensor module's status page HTML
+save_config_snapshot() - save a sensor config to a local file
 scrape_sensor_module() - get all readings from an identified sensor module
+write_checkpoint() - save sensor states to a checkpoint file
 
 Terminology and Conceptual Organization of Netbotz Components
 ----------------------------------
@@ -86,11 +118,34 @@ CREATE  TABLE IF NOT EXISTS `sensordata`.`sensor` (
   `track_data` TINYINT(1)  NOT NULL DEFAULT TRUE ,
   `poll_interval` INT NULL COMMENT 'Defines how many seconds between regular updates of the given value.  \n\nIf 0, we update with every change in value.' ,
   `alert_threshold` DECIMAL(3) NULL COMMENT 'Defines a threshold as a percentage of variance from the last value which, when exceeded, causes an immediate data update regardless of the poll_interval.\n\nThis value is ignored when poll_interval is 0.	' ,
+  `adaptive_interval` TINYINT(1)  NOT NULL DEFAULT FALSE COMMENT 'If set, the sensor is watched for threshold alerts more or less often depending on how much its value has been changing (see SensorChecker.watch_interval()).' ,
   PRIMARY KEY (`id`, `module`) )
 ENGINE = InnoDB;
 
+-- -----------------------------------------------------
+-- Table `sensordata`.`reading`
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS `sensordata`.`reading` (
+  `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT ,
+  `name` VARCHAR(100) NOT NULL COMMENT 'SensorReading display name (module display name and sensor name)' ,
+  `ts` DATETIME NOT NULL ,
+  `value` DOUBLE NULL COMMENT 'Numeric readings' ,
+  `text_value` VARCHAR(45) NULL COMMENT 'Non-numeric readings (e.g. \"N/A\" from a disconnected sensor)' ,
+  `sensor_condition` VARCHAR(45) NULL ,
+  PRIMARY KEY (`id`) )
+ENGINE = InnoDB
+COMMENT = 'Written by MySQLReadingSink; not needed for polling' ;
+
+CREATE INDEX `name_ts` ON `sensordata`.`reading` (`name` ASC, `ts` ASC) ;
+
  - - - - - end mysql schema - - - - -
 
+A database created before the sensor.adaptive_interval column was added
+still works: pybotz warns and treats every sensor as having it unset.  To 
+use adaptive watch intervals, add the column (and restart pybotz):
+
+ALTER TABLE `sensordata`.`sensor` ADD COLUMN `adaptive_interval` TINYINT(1) NOT NULL DEFAULT FALSE ;
+
 Tested Hardware
 ----------------------------------
 Testing was done on an installation with two Netbotz 500 appliances and a 
@@ -100,32 +155,100 @@ serious thought has been given to this.
 
 Compatibility
 ----------------------------------
-Tested on MacOS and Linux.  Signal handling won't work on Windows without
-some changes.
+Tested on MacOS and Linux.  Request timeouts are enforced with socket timeouts
+rather than signals, so polling works from any thread.  Only the daemon (see 
+main()) installs signal handlers, from its main thread.
 
 [1] http://www.netbotz.com/products/appliances.html
 
 """
 
+import os
 import sys
 import re
 import argparse
 import time
-import urllib2
 import signal
+import logging
+import random
+import heapq
+import itertools
+import collections
+import atexit
+import array
+import hashlib
+import json
+import httplib
+import BaseHTTPServer
+import SocketServer
+import urlparse
+import socket
+import select
+import threading
+import multiprocessing
+import zlib
+import struct
+import fcntl
+import mmap
+import Queue
 from datetime import datetime, timedelta
 import MySQLdb
 
 from BeautifulSoup import BeautifulSoup
 
+try:
+  import numpy
+except ImportError:                      ## only needed for config['batch_evaluation']
+  numpy = None
+
+_log = logging.getLogger("pybotz")
+
 config = {}
 """Module-global dict of configuration settings."""
 
 config['default_interval'] = 10 * 60     ## poll every 10 minutes
 config['default_threshold'] = 0.50       ## alert immediately if a value changes 50%
 config['self_report_interval'] = 15 * 60 ## report on poll stats every 15 minutes
+config['max_concurrency'] = 1            ## modules polled at once by CheckerPool (1 = serial)
+config['max_per_host'] = 2               ## modules polled at once on any single netbotz host
+config['connect_timeout'] = 5            ## seconds allowed to establish a connection to a host
+config['read_timeout'] = 5               ## seconds allowed between bytes received from a host
+config['request_timeout'] = 20           ## seconds allowed for an entire page retrieval
+config['max_host_connections'] = 2       ## persistent connections kept open to each host
+config['connection_idle_timeout'] = 30   ## seconds an unused persistent connection is kept
+config['parser'] = 'fast'                ## status page parser: 'fast' or 'soup' (see parse_status_page())
+config['threshold_poll_interval'] = 60   ## seconds between fetches for threshold alerts (see Scheduler)
+config['retry_interval'] = 30            ## seconds before a Scheduler retries a module that failed
+config['archive'] = None                 ## path of an archive to record every retrieved page in (see ArchiveWriter)
+config['reload_interval'] = 60           ## seconds between PollingDaemon checks for sensor config changes (0 = SIGHUP only)
+config['checkpoint'] = None              ## path of the sensor state checkpoint kept by PollingDaemon (see Checkpoint)
+config['checkpoint_interval'] = 60       ## seconds between PollingDaemon checkpoints
+config['config_snapshot'] = None         ## path of a local copy of the sensor config to start from (see save_config_snapshot())
+config['reconcile_retry_interval'] = 30  ## seconds between attempts to reach the db after starting from a snapshot
+config['db_connect_timeout'] = 10        ## seconds allowed to connect to the MySQL db
+config['sink_batch_size'] = 500          ## readings written per batch by a ReadingSink
+config['sink_max_age'] = 5               ## seconds a reading may wait in a ReadingSink before a flush
+config['sink_max_buffered'] = 100000     ## readings a ReadingSink holds before dropping the oldest
+config['history_capacity'] = 0           ## readings kept in each sensor's SensorHistory (0 = no history)
+config['batch_evaluation'] = False       ## evaluate a whole sweep at once with a BatchEvaluator
+config['pipeline'] = False               ## poll through separate fetch/parse/evaluate stages (see PipelinedPoller)
+config['pipeline_parse_workers'] = 2     ## parse threads of a PipelinedPoller
+config['pipeline_queue_size'] = 64       ## modules each PipelinedPoller stage's queue holds before blocking
+config['breaker_failures'] = 3           ## consecutive failed requests before a host's CircuitBreaker opens
+config['breaker_backoff'] = 30           ## seconds a CircuitBreaker first stays open (doubles each time)
+config['breaker_max_backoff'] = 15 * 60  ## longest a CircuitBreaker stays open before probing the host
+config['breaker_jitter'] = 0.2           ## fraction by which open periods are randomly shortened
+config['adaptive_min_interval'] = 15     ## shortest watch interval of a sensor with adaptive_interval set
+config['adaptive_max_interval'] = 10 * 60 ## longest watch interval of a sensor with adaptive_interval set
+config['adaptive_step'] = 2              ## factor by which an adaptive watch interval widens or tightens
+config['adaptive_flat'] = 0.1            ## changes under this fraction of the alert threshold count as flat
+config['discovery_ttl'] = 60 * 60        ## seconds FleetDiscovery caches a host's module list
+config['discovery_concurrency'] = 16     ## hosts listed (or modules scraped) at once by FleetDiscovery
+config['statsd_packet_size'] = 1432      ## largest datagram a StatsdSink sends (fits a typical MTU)
+config['shards'] = None                  ## worker processes in a ShardedCheckerPool (None = one per CPU)
+config['shard_state_interval'] = 60      ## seconds between sensor state hand-offs from a ShardedCheckerPool worker
 
-class SensorReading:
+class SensorReading(object):
   """Base class for a general sensor reading.
   
   Instance variables:
@@ -134,35 +257,61 @@ class SensorReading:
   Public methods:
   key()
   value()
+  available()
+  condition()
   set()
+  stamped()
   display_name()
   unit_string()  
-  """
 
-  _sensor_key = None
-  _sensor_value = None
+  A sweep creates one reading for every row of every page, so readings use 
+  __slots__, and the value is converted to a number once when it is set 
+  rather than every time it is asked for.
+  """
 
-  ts = None;
-  """Timestamp of the reading."""
+  __slots__ = ('ts', '_sensor_key', '_sensor_value', '_value', '_available', '_display_prefix')
+  ## ts -- timestamp of the reading
+  ## _sensor_value -- the value as reported (and displayed)
+  ## _value -- the value as an int or float if it is numeric, otherwise as reported
+  ## _available -- True if the value is numeric (e.g. not "N/A" from a disconnected sensor)
+  ## _display_prefix -- a string which will be prepended to the _sensor_key for display 
+  ##   purposes.  This is useful when showing multiple sensors with the same name that are
+  ##   connected to different hosts or modules.
 
   def __init__(self, timestamp, display_prefix=None):
-    """Initialize a new SensorReading and parse initial HTML fragment.
+    """Initialize a new SensorReading.
     
     Arguments:
     timestamp -- the time associated with the reading
     display_prefix -- string to logically scope the sensor name for display (default None)
     """
     self.ts = timestamp
-    if (display_prefix):
-      self._display_prefix = display_prefix
+    self._sensor_key = None
+    self._sensor_value = None
+    self._value = None
+    self._available = False
+    self._display_prefix = _intern(display_prefix) or None
 
   def __repr__(self):
     return "SensorReading _sensor_key:%s _sensor_value:%s" % \
       (self._sensor_key, self._sensor_value)
 
   def __str__(self):
-    r_str = self._sensor_key + " = " + self._sensor_value + self.unit_string()
-    return r_str
+    return "%s = %s%s" % (self._sensor_key, self._sensor_value, self.unit_string())
+
+  def __getstate__(self):
+    return dict([(name, getattr(self, name)) for name in self._all_slots()])
+
+  def __setstate__(self, state):
+    for (name, v) in state.iteritems():
+      setattr(self, name, v)
+
+  @classmethod
+  def _all_slots(cls):
+    names = []
+    for c in cls.__mro__:
+      names.extend(c.__dict__.get('__slots__', ()))
+    return names
 
   def key(self):
     """Return key name (_sensor_key)."""
@@ -170,25 +319,46 @@ class SensorReading:
     return self._sensor_key
 
   def value(self):
-    """Return reading value."""
-    if isinstance(self._sensor_value, float):
-      return float(self._sensor_value)
-    else:
-      try:
-          return int(self._sensor_value)
-      except ValueError:
-          try:
-            return float(self._sensor_value)
-          except ValueError:
-            return (self._sensor_value)
+    """Return reading value (an int or float if it is numeric, otherwise as reported)."""
+    return self._value
+
+  def available(self):
+    """Return True if the reading has a numeric value."""
+    return self._available
+
+  def condition(self):
+    """Return the alert condition reported with the reading (None if there isn't one)."""
+    return None
 
   def set(self, key, value):
     """Manually set the key and value for a SensorReading."""
     """This is a utility function to enable a corner use case where we're just using SensorReading
     as a light wrapper datastructure.  If some usage pattern is going to frequently do this there
     are doubtless more elegant interfaces to offer."""
-    self._sensor_key = key
+    self._sensor_key = _intern(key)
+    self._set_value(value)
+
+  def stamped(self, timestamp):
+    """Return a copy of this reading with a different timestamp."""
+    r = object.__new__(self.__class__)
+    for name in self._all_slots():
+      setattr(r, name, getattr(self, name))
+    r.ts = timestamp
+    return r
+
+  def _set_value(self, value):
+    """Store the reported value along with its numeric conversion."""
     self._sensor_value = value
+    if isinstance(value, (int, long, float)):
+      (self._value, self._available) = (value, True)
+      return
+    try:
+      (self._value, self._available) = (int(value), True)
+    except ValueError:
+      try:
+        (self._value, self._available) = (float(value), True)
+      except ValueError:
+        (self._value, self._available) = (value, False)
 
   def display_name(self):
     """Return key name for display."""
@@ -199,14 +369,21 @@ class SensorReading:
 
   def unit_string(self):
     """Return appropriate unit string."""
-    if self._sensor_key in ("Temperature","Dew Point"):
-      return " F"
-    elif self._sensor_key == "Humidity":
-      return " %"
-    elif self._sensor_key == "Air Flow":
-      return " ft/min"
-    else:
-      return ""
+    return _UNIT_STRINGS.get(self._sensor_key, "")
+
+_UNIT_STRINGS = {
+  'Temperature': " F",
+  'Dew_Point': " F",
+  'Humidity': " %",
+  'Air_Flow': " ft/min",
+}
+"""Units displayed after the value of a reading, keyed by (normalized) sensor key."""
+
+def _intern(s):
+  """Return an interned copy of a byte string (other values are returned unchanged)."""
+  if type(s) is str:
+    return intern(s)
+  return s
 
 class NBSensorReading(SensorReading):
   """Represents a single reading of a given Netbotz sensor at a point in time.
@@ -215,36 +392,41 @@ class NBSensorReading(SensorReading):
   
   Public methods:
   load_from_HTML(frag)
+  load_from_cells(key, value, condition)
   """
     
-  _sensor_condition = None
-  """Indicates if the current reading is in an alert state."""
-  
-  _display_prefix = None
-  """A string which will be prepended to the _sensor_key for display purposes.
-  This is useful when showing multiple sensors with the same name that are 
-  connected to different hosts or modules."""
+  __slots__ = ('_sensor_condition',)
+  ## _sensor_condition -- indicates if the current reading is in an alert state
     
   def __init__(self, timestamp, htmlfrag, display_prefix=None):
     """Initialize a new NBSensorReading and parse initial HTML fragment.
     
     Arguments:
     timestamp -- the time associated with the reading
-    htmlfrag -- portion of html (e.g. from BeautifulSoup) that contains the sensor data
+    htmlfrag -- portion of html (e.g. from BeautifulSoup) that contains the sensor data,
+                or a (key, value, condition) tuple of the raw cell strings
     display_prefix -- string to logically scope the sensor name for display (default None)
     """
     SensorReading.__init__(self, timestamp, display_prefix)
-    self.load_from_HTML(htmlfrag)
+    self._sensor_condition = None
+    if isinstance(htmlfrag, tuple):
+      self.load_from_cells(*htmlfrag)
+    else:
+      self.load_from_HTML(htmlfrag)
 
   def __repr__(self):
     return "NBSensorReading _sensor_key:%s _sensor_value:%s _sensor_condition:%s" % \
       (self._sensor_key, self._sensor_value, self._sensor_condition)
   
   def __str__(self):
-    r_str = self._sensor_key + " = " + self._sensor_value + self.unit_string()
+    r_str = SensorReading.__str__(self)
     if (self._sensor_condition):
       r_str += " (" + self._sensor_condition + ")"
     return r_str
+
+  def condition(self):
+    """Return the alert condition ("" when the sensor isn't alerting)."""
+    return self._sensor_condition
       
   def load_from_HTML(self, frag):
     """Parse an HTML fragment to extract sensor data.
@@ -252,6 +434,19 @@ class NBSensorReading(SensorReading):
     Arguments:
     frag -- fragment of HTML (e.g. from BeautifulSoup)
 
+    See load_from_cells() for the normalization applied.
+    """
+    cells = frag.findAll("td")
+    self.load_from_cells(cells[0].string, cells[1].a.string, cells[2].string)
+
+  def load_from_cells(self, key, value, condition):
+    """Set sensor data from the raw strings of the three cells of a sensortable row.
+
+    Arguments:
+    key -- text of the first cell (e.g. "Temperature:")
+    value -- text of the link in the second cell (e.g. "72.5 F")
+    condition -- text of the third cell ("---" when not alerting)
+
     Notes:
     * Certain unit values are stripped from the reading and stored separately.
       Unrecognized units will not be stripped, and may confuse readings.
@@ -259,470 +454,4431 @@ class NBSensorReading(SensorReading):
     * Spaces in key or value names are converted to '_'
     * Parens are stripped from key names
     """
-    cells = frag.findAll("td")
-    self._sensor_key = re.sub("\:$", "", cells[0].string)
+    if key is None or value is None:
+      raise AttributeError("sensortable row is missing its key or value")
+    key = _TRAILING_COLON.sub("", key)
 
     ## strip out units and decoration from value field - details depend on key
-    if self._sensor_key in ('Temperature', 'Humidity', 'Dew Point', 'Air Flow', 'Audio'):
+    if key in ('Temperature', 'Humidity', 'Dew Point', 'Air Flow', 'Audio'):
       # grab the leading numeric value 
-      try:
-        self._sensor_value = re.match(r"\d+\.?\d*", cells[1].a.string).group(0)
-      except AttributeError:          ## disconnected sensor pods leave us with "N/A" values
-        self._sensor_value = cells[1].a.string
-    else:
-      # treat everything else as a string
-      ## (this has obvious limitations, and is a laziness enabled by a data coincidence)
-      self._sensor_value = cells[1].a.string
+      m = _LEADING_NUMBER.match(value)
+      if m:
+        value = m.group(0)
+      ## (otherwise, disconnected sensor pods leave us with "N/A" values)
+    ## treat everything else as a string
+    ## (this has obvious limitations, and is a laziness enabled by a data coincidence)
 
-    if cells[2].string == ('---'):
+    if condition == ('---'):
       self._sensor_condition = ""
     else:
-      self._sensor_condition = cells[2].string
+      self._sensor_condition = condition
 
-    self._sensor_key = re.sub(" ", "_", self._sensor_key)
-    self._sensor_key = re.sub("\(","",self._sensor_key)      
-    self._sensor_key = re.sub("\)","",self._sensor_key)
-    self._sensor_value = re.sub(" ", "_", self._sensor_value)
+    self._sensor_key = _intern(key.replace(" ", "_").replace("(", "").replace(")", ""))
+    value = value.replace(" ", "_")
 
     ## re-map certain non-numeric values to numerics for graphing
-    if self._sensor_value in ("Closed", "No_Motion"):
-      self._sensor_value = 0
-    elif self._sensor_value in ("Open", "Motion_Detected"):
-      self._sensor_value = 1
+    if value in ("Closed", "No_Motion"):
+      value = 0
+    elif value in ("Open", "Motion_Detected"):
+      value = 1
+    self._set_value(value)
 
-####################################
-def get_sensor_modules(sensor_host):
-  """Return a list of connected sensor units on a given netbotz sensor host."""
+_TRAILING_COLON = re.compile(r"\:$")
+_LEADING_NUMBER = re.compile(r"\d+\.?\d*")
 
-  r = []
-  
-  ## look for connected sensor units
-  sensor_html = urllib2.urlopen(sensor_host + "/pages/menu_noscript.html").read()
-  sensor_soup = BeautifulSoup(sensor_html)
-  
-  sensor_units = sensor_soup.findAll({'a' : True, 'target' : 'sensor'})
-  for su in sensor_units:
-    sensor = re.match(r"status.html\?encid=(.+)",su['href']).group(1)
-    if sensor != "nbSensorSet_Alerting":
-      r.append(sensor)
-  
-  return r
+_SENSORTABLE = re.compile(r"""<table\b[^>]*\bclass\s*=\s*["']?sensortable\b[^>]*>(.*?)</table\s*>""", re.I | re.S)
+_TABLE_ROW = re.compile(r"<tr\b[^>]*>(.*?)</tr\s*>", re.I | re.S)
+_TABLE_CELL = re.compile(r"<td\b[^>]*>(.*?)</td\s*>", re.I | re.S)
+_LINK = re.compile(r"<a\b[^>]*>(.*?)</a\s*>", re.I | re.S)
+_OPEN_TAG = dict([(tag, re.compile(r"<%s\b" % tag, re.I)) for tag in ("table", "tr", "td")])
 
-def scrape_sensor_module(sensor_host, sensor_module):
-  """Return list of SensorReadings from a specified host / sensor unit.
-  
-  Arguments:
-  sensor_host -- (string) hostname or IP of netbotz unit
-  sensor_module -- name of the netbotz module to scrape.
+def _tag_string(content):
+  """Return content if it is a single run of text (as BeautifulSoup's .string would), else None."""
+  if content and "<" not in content:
+    return content
+  return None
+
+def _sensor_rows_fast(html):
+  """Return (key, value, condition) strings for each sensortable row, using precompiled patterns.
+
+  Only the sensortable itself is examined.  Rows that can't be interpreted are 
+  returned as None.  Returns None if no sensortable is found, or if its 
+  markup is beyond the patterns (a nested table, or a row or cell left 
+  unclosed), in which case BeautifulSoup has to repair it.
   """
-  page = urllib2.urlopen(sensor_host + "/pages/status.html?encid=" + sensor_module)
+  table = _SENSORTABLE.search(html)
+  if table is None or _OPEN_TAG["table"].search(table.group(1)):
+    return None
+  table_rows = _TABLE_ROW.findall(table.group(1))
+  if len(table_rows) != len(_OPEN_TAG["tr"].findall(table.group(1))):
+    return None
+  rows = []
+  for row in table_rows[1:]:                            ## skip the header row
+    cells = _TABLE_CELL.findall(row)
+    if len(cells) != len(_OPEN_TAG["td"].findall(row)):
+      return None
+    link = len(cells) >= 3 and _LINK.search(cells[1])
+    if not link:
+      rows.append(None)
+      continue
+    rows.append((_tag_string(cells[0]), _tag_string(link.group(1)), _tag_string(cells[2])))
+  return rows
 
-  html = page.read()
-  reading_ts = datetime.now()
-  soup = BeautifulSoup(html)
+def _sensor_rows_soup(html):
+  """Return (key, value, condition) strings for each sensortable row, using BeautifulSoup.
 
-  outerTable = soup.findAll('table', limit=1)[0]
+  Rows that can't be interpreted are returned as None.  Returns None if no 
+  sensortable is found.
+  """
+  sensorTable = BeautifulSoup(html).find("table", "sensortable")
+  if sensorTable is None:
+    return None
+  rows = []
+  for row in sensorTable.findAll("tr")[1:]:             ## skip the header row
+    cells = row.findAll("td")
+    try:
+      rows.append((cells[0].string, cells[1].a.string, cells[2].string))
+    except (AttributeError, IndexError):
+      rows.append(None)
+  return rows
 
-  ## the sensor unit label is bolded in the 2nd td tag with a trailing colon
-  ## (fairly fragile) 
-  nbSourceFrag = outerTable.findAll('td', limit=2)[1].b.contents
-  nbSourceLabel = re.sub("\:$", "", nbSourceFrag[0].string)
+_row_parsers = {
+  'fast': _sensor_rows_fast,
+  'soup': _sensor_rows_soup,
+}
+"""Sensortable row extractors selectable with config['parser']."""
 
-  #print "------------------"
-  #print "Scraping netbotz unit %s, sensor %s" % (nbSourceLabel, sensor_module)
-  #print
+def parse_status_page(html, timestamp, display_prefix=None, parser=None):
+  """Return a list of NBSensorReadings parsed from a module's status page.
 
-  sensorTable = soup.find("table", "sensortable")
+  Arguments:
+  html -- (string) contents of status.html for a sensor module
+  timestamp -- the time associated with the readings
+  display_prefix -- string to logically scope the sensor names for display (default None)
+  parser -- name of the row extractor to use (default config['parser'])
 
-  #print sensorTable
+  Rows which can't be parsed are skipped.  If the chosen parser can't find (or
+  can't reliably read) the sensor table, BeautifulSoup is used as a fallback.
+  """
+  if parser is None:
+    parser = config['parser']
+  rows = _row_parsers[parser](html)
+  if rows is None and parser != 'soup':
+    rows = _sensor_rows_soup(html)
+  if rows is None:
+    raise ValueError("No sensortable found in status page.")
 
-  sensorRows = sensorTable.findAll("tr")
+  readings = []
+  for cells in rows:
+    if cells is None:
+      continue
+    try:
+      readings.append(NBSensorReading(timestamp, cells, display_prefix))
+    except AttributeError:
+      ## we get this if load_from_cells fails
+      continue
+  return readings
 
-  sensorReadings = []
-  for i in range(1, len(sensorRows)):
-    r = NBSensorReading(reading_ts, sensorRows[i])
-    sensorReadings.append(r)
-    #print r
+class DeadlineExceeded(IOError):
+  """Raised when a request runs past its total time budget."""
 
-  return sensorReadings
+class Deadline:
+  """Time budgets for a single HTTP request.
 
-class CheckerPool:
-  """A simple collection of SensorModuleChecker instances.
-  
   Public methods:
-  check()
+  connect_timeout()
+  read_timeout()
+  remaining()
+
+  All budgets are enforced with socket timeouts rather than signals, so a 
+  Deadline may be used from any thread.
   """
 
-  _SMC = None   
-  """List of SensorModuleCheckers."""
-  
-  _dbh = None
+  _connect = None
+  _read = None
+  _expires = None
+
+  def __init__(self, connect=None, read=None, total=None):
+    """Start the clock on a new request.
 
-  def __init__(self, dbh):
-    """Create new CheckerPool tied to the given database.
-    
     Arguments:
-    dbh -- connected database handle to the db containing the sensor config
+    connect -- seconds allowed to establish the connection (default config['connect_timeout'])
+    read -- seconds allowed between bytes received (default config['read_timeout'])
+    total -- seconds allowed for the entire request (default config['request_timeout'])
     """
-    
-    self._SMC = []
-    self._dbh = dbh
-    self._initialize_pool()
-    
-  def _initialize_pool(self):
-    """Create SensorModuleChecker objects for each module defined in the database and add to
-    the pool."""
-    
-    c = self._dbh.cursor()
-    c.execute("""SELECT id, address FROM host""")  
-    for row in c.fetchall():
-      host = "http://" + row[1]
-      hostid = row[0]
-      c.execute("""SELECT module_name, display_name, id FROM sensor_module WHERE host = %s AND track_data = TRUE""", (hostid,))
-      sensor_modules = c.fetchall()
-      for (module_name, display_name, module_id) in sensor_modules:
-        smc = SensorModuleChecker(host, module_name, display_name, module_id, self._dbh)
-        self._SMC.append(smc)
-    c.close()
-    
-  def check(self):
-    """Check all sensors, return list of alerting SensorReadings."""
-    new_alerts = []
-    for smc in self._SMC:
-      new_alerts.extend(smc.check()) 
-    return new_alerts
+    if connect is None:
+      connect = config['connect_timeout']
+    if read is None:
+      read = config['read_timeout']
+    if total is None:
+      total = config['request_timeout']
+    self._connect = connect
+    self._read = read
+    self._expires = time.time() + total
+
+  def remaining(self):
+    """Return seconds left in the total budget; raise DeadlineExceeded if none are."""
+    left = self._expires - time.time()
+    if left <= 0:
+      raise DeadlineExceeded("Request deadline exceeded.")
+    return left
+
+  def connect_timeout(self):
+    """Return the socket timeout to use while connecting."""
+    return min(self._connect, self.remaining())
+
+  def read_timeout(self):
+    """Return the socket timeout to use for the next read."""
+    return min(self._read, self.remaining())
+
+class HostConnectionPool:
+  """Persistent (keep-alive) HTTP connections to a single netbotz host.
 
-class SensorModuleChecker:
-  """A single "Sensor Module", which is a unit of Netbotz hardware for which 
-  we get results.  
-  
   Public methods:
-  check()
-  avg_poll_time()
-  num_failures()
-  num_successes()
-  
-  Public attributes:
-  self_report_interval_len
-  
-  Note: A module may contain multiple different sensors, 
-  but since we bear the majority of the retrieval cost in getting the HTML, 
-  we group them together for performance reasons.
+  acquire()
+  release()
+  discard_idle()
+
+  The embedded web server is slow to accept new connections, so connections 
+  are kept open between requests and shared by every SensorModuleChecker on 
+  the host.  At most max_size connections are open at once; callers beyond
+  that wait (within their Deadline) for one to be released.
   """
-  
-  ## FIXMEs:
-  ##
-  ## * At most, db_id should be an optional argument (to save a db query) -- 
-  ##   there's no reason we can't query for the id from here.
-  
-  self_report_interval = None
-  """A timedelta object describing the interval (in seconds) between reports 
-  on the speed and success rate of the sensor check.  
-  Failure/success counters and average time are reset after each report."""
-  
-  _sensors = None
-  _url = None
-  _html = None 
-  _html_ts = None
-  _dbh = None  
+
   _host = None
-  _module_name = None
-  _display_name = None
-  _db_id = None
-  _read_timeout = 20
-  _avg_poll_time = None
-  _poll_failure_count = None
-  _poll_success_count = None
-  _next_self_report = None
+  _port = None
+  _max_size = None
+  _idle_timeout = None
+
+  _idle = None
+  """List of (HTTPConnection, time last released), most recently used last."""
+
+  _open = None
+  """Number of connections currently open, idle or in use."""
+
+  _cond = None
+
+  def __init__(self, host, port=None, max_size=None, idle_timeout=None):
+    """Create an empty pool.
 
-  def __init__(self, host, module_name, display_name, db_id, dbh):
-    """Initialize the SensorModule, including instantiating associated SensorCheckers.
-    
     Arguments:
-    host -- hostname or IP of the netbotz hardware
-    module_name -- (string) netbotz name for the module
-    display_name -- name used for display (may be more intelligible than netbotz' name)
-    db_id -- id # of this module in the config database
-    dbh -- connected database handle to the db containing the sensor config
+    host -- hostname or IP of the netbotz unit
+    port -- TCP port (default 80)
+    max_size -- maximum open connections (default config['max_host_connections'])
+    idle_timeout -- seconds before an unused connection is closed (default config['connection_idle_timeout'])
     """
-    self._sensors = []
+    if max_size is None:
+      max_size = config['max_host_connections']
+    if idle_timeout is None:
+      idle_timeout = config['connection_idle_timeout']
     self._host = host
-    self._module_name = module_name
-    self._display_name = display_name
-    self._db_id = db_id
-    self._dbh = dbh
-    self.self_report_interval = timedelta(0,config['self_report_interval'])
-    
-    self._url = self._host + "/pages/status.html?encid=" + self._module_name
-    #print "DEBUG: instantiating SMC for %s (%s, %d)" % (self._module_name, self._display_name, self._db_id)
-    #print "           url = %s" % self._url
-    self._init_sensors()
-    self._init_selfrpt_interval()
-    #print "DEBUG: %d sensors found" % len(self._sensors)
-
-  def _read_timeout_handler(self, signum, frame):
-    raise IOError("Read timeout exceeded.")
-    
-  def _init_sensors(self):
-    """Create sensor objects for all defined & enabled sensors."""
-    #print "DEBUG: _init_sensors() for %s" % self._display_name
-    c = self._dbh.cursor()
-    c.execute("""SELECT id, sensor_name FROM sensor WHERE module = %s AND track_data = TRUE""", (self._db_id))
-    sensors = c.fetchall()
-    c.close()
-    #print "DEBUG: %d sensors for %s" % (len(sensors), self._display_name)
-    for (sensor_id, sensor_name) in sensors:
-      s = SensorChecker(sensor_name, sensor_id, self._dbh)
-      self._sensors.append(s)
+    self._port = port
+    self._max_size = max_size
+    self._idle_timeout = idle_timeout
+    self._idle = []
+    self._open = 0
+    self._cond = threading.Condition()
 
-  def _init_selfrpt_interval(self):
-    """Reset counters and interval timer for self-reporting."""
-    self._avg_poll_time = None
-    self._poll_failure_count = 0
-    self._poll_success_count = 0
-    self._next_self_report = datetime.now() + self.self_report_interval
-    
-  def _record_poll_run(self,start,end):
-    """Updates the running average poll time and success counter.  Takes start and end of a polling run."""
-    self._poll_success_count += 1
-    if self._avg_poll_time is None:
-      self._avg_poll_time = end - start
-    else:
-      self._avg_poll_time = (self._avg_poll_time + (end - start)) / self._poll_success_count
-      
-    # print "DEBUG: average %s seconds to poll (%d/%d successful)" % (self._avg_poll_time, self._poll_success_count, 
-    #                                                               self._poll_success_count + self._poll_failure_count)
+  def acquire(self, deadline):
+    """Return (connection, reused) with a connected HTTPConnection.
 
-  def _retrieve_HTML(self):
-    """Retrieve the HTML containing this module's update.
-    
-    Side effects:
-    - on success, increment success counter and add timing data to current running average
-    - on failure (of any sort), increment failure counter
+    reused is True if the connection has served a previous request (and so 
+    may have been closed by the server in the meantime).
     """
-    self._html = None
-    
-    start_time = datetime.now()
+    self._cond.acquire()
     try:
-      page = urllib2.urlopen(self._url)
-    except urllib2.URLError, e:
-      print "Networking error: %s" % e
-      self._poll_failure_count += 1
-      self._html = None
-      return
-    
-    ## read() will run forever if the connection gets flaky or goes away
-    signal.signal(signal.SIGALRM, self._read_timeout_handler)
-    signal.alarm(5)    
+      while True:
+        self._evict_idle()
+        if self._idle:
+          return (self._idle.pop()[0], True)
+        if self._open < self._max_size:
+          self._open += 1
+          break
+        self._cond.wait(deadline.remaining())
+    finally:
+      self._cond.release()
+
+    conn = httplib.HTTPConnection(self._host, self._port, timeout=deadline.connect_timeout())
     try:
-      self._html = page.read()
-    except IOError:
-      print "Read timeout."
-      self._poll_failure_count += 1
-      self._html = None
+      conn.connect()
+    except:
+      self._closed()
+      raise
+    return (conn, False)
+
+  def release(self, conn, reusable=True):
+    """Return a connection to the pool, or close it if it can't be reused."""
+    if not reusable:
+      conn.close()
+      self._closed()
       return
-    signal.alarm(0)
-    
-    self._html_ts = datetime.now()
-    self._record_poll_run(start_time, self._html_ts)
-  
-  def _self_report(self):
-    """Return SensorReadings for failure rates and average HTML poll time.
-    
-    Side effects: starts new self-report interval and resets counters
-    """
-    r = []
-    
-    total = (self._poll_success_count + self._poll_failure_count)
-    if total > 0:
-      failure_rate = SensorReading(datetime.now(), self._display_name + "-")
-      failure_rate.set("poll_failure_rate", float(self._poll_failure_count / total))
-      r.append(failure_rate)
+    self._cond.acquire()
+    try:
+      self._idle.append((conn, time.time()))
+      self._cond.notify()
+    finally:
+      self._cond.release()
 
-    if self._poll_success_count > 0:
-      avg_poll = SensorReading(datetime.now(), self._display_name + "-")
-      avg_poll.set("avg_html_retrieval", self.avg_poll_time())
-      r.append(avg_poll)
+  def discard_idle(self):
+    """Close all idle connections (e.g. after one turned out to be stale)."""
+    self._cond.acquire()
+    try:
+      while self._idle:
+        self._idle.pop()[0].close()
+        self._open -= 1
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
 
-    self._init_selfrpt_interval()
-    return r
-    
-  def check(self):
-    """Check all sensors, return list of alerting SensorReadings."""
-    new_alerts = []
-    self._retrieve_HTML()
+  def _closed(self):
+    self._cond.acquire()
+    try:
+      self._open -= 1
+      self._cond.notify()
+    finally:
+      self._cond.release()
 
-    if (self._html is None):
-      print "HTML is null, skipping check."
-      return new_alerts
+  def _evict_idle(self):
+    """Close connections idle longer than the idle timeout.  Caller holds the lock."""
+    cutoff = time.time() - self._idle_timeout
+    while self._idle and self._idle[0][1] < cutoff:
+      self._idle.pop(0)[0].close()
+      self._open -= 1
 
-    # parse the HTML to get updated sensor readings
-    soup = BeautifulSoup(self._html)
-    outerTable = soup.findAll('table', limit=1)[0]
-    sensorTable = soup.find("table", "sensortable")
-    sensorRows = sensorTable.findAll("tr")
+_connection_pools = {}
+"""HostConnectionPools keyed by (host, port)."""
 
-    ## There may be sensor readings we don't care about parsed from the HTML, but we need to parse them all
-    ##   to see what they are.
-    ##
-    ## NB:  this is a probably area for algorithmic efficiency improvement, but my gut is it's immaterial
-    sensorReadings = {}
-    for i in range(1, len(sensorRows)):
-      try:
-        r = NBSensorReading(self._html_ts, sensorRows[i], self._display_name + "-")
-      except AttributeError:
-        ## we get this if load_from_HTML fails
-        continue
-      sensorReadings[r.key()] = r
-    
-    for s in self._sensors:
-      if not s.name() in sensorReadings:   ## need this in case the NBSensorReading instantiation above failed
-        continue
-      if (sensorReadings[s.name()]):            ## if we just got an update for this sensor
-        if s.needs_check() or s.exceeds_threshold(sensorReadings[s.name()]):  ## ... and it's attention-worthy
-          s.update(sensorReadings[s.name()])
-          sr = s.get_data_update()
-          if (sr):                              ##  ... and it is different than the last value
-            new_alerts.append(sr)               ##  ... then alert on it.
+_connection_pools_lock = threading.Lock()
 
-    if datetime.now() > self._next_self_report:
-      new_alerts.extend(self._self_report())
+def get_connection_pool(host, port=None):
+  """Return the shared HostConnectionPool for a host, creating it if necessary."""
+  _connection_pools_lock.acquire()
+  try:
+    pool = _connection_pools.get((host, port))
+    if pool is None:
+      pool = HostConnectionPool(host, port)
+      _connection_pools[(host, port)] = pool
+    return pool
+  finally:
+    _connection_pools_lock.release()
 
-    return new_alerts
+class CircuitBreaker:
+  """Health of a single netbotz host, used to stop polling it while it is down.
 
-  def avg_poll_time(self):
-    """Returns float from underlying timedelta."""
-    try:
-      return self._avg_poll_time.total_seconds()
-    except AttributeError:  # total_seconds() is new in python 2.7
-      td = self._avg_poll_time
-      return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
-      
-    
-  def num_failures(self):
-    return self._poll_failure_count
-    
-  def num_successes(self):
-    return self._poll_success_count
-
-class SensorChecker:
-  """A single netbotz sensor.
-  
   Public methods:
-  exceeds_threshold()
-  get_data_udpate()
-  name()
-  needs_check()
-  update()
+  allow_request()
+  record_success()
+  record_failure()
+  state()
+  retry_at()
+  report()
+
+  The breaker starts "closed": requests go through, and consecutive failures 
+  are counted.  After config['breaker_failures'] of them it "opens", and all 
+  requests to the host are refused (without touching the network) for a 
+  backoff period which doubles with each consecutive opening, up to 
+  config['breaker_max_backoff'], and is randomly shortened by up to 
+  config['breaker_jitter'] so that hosts which failed together don't all come 
+  back together.  Once the backoff has passed the breaker is "half-open": a 
+  single probe request is let through, and every other module on the host 
+  waits for its outcome.  A successful probe closes the breaker; a failed one 
+  opens it again.
   """
+
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half-open"
+
+  _host = None
+  _state = None
+  _failures = None
+  """Consecutive failed requests."""
+
+  _openings = None
+  """Consecutive times the breaker has opened without a successful request in between."""
+
+  _retry_at = None
+  """time.time() after which an open breaker allows a probe (or a half-open probe is given up on)."""
+
+  _transitions = None
+  _refused = None
+  """State changes and refused requests since the last report()."""
+
+  _lock = None
+
+  def __init__(self, host):
+    self._host = host
+    self._state = CircuitBreaker.CLOSED
+    self._failures = 0
+    self._openings = 0
+    self._transitions = 0
+    self._refused = 0
+    self._lock = threading.Lock()
+
+  def allow_request(self):
+    """Return True if a request to the host may be made now.
+
+    When the backoff of an open breaker has passed, the first caller gets 
+    True (as the probe) and the breaker becomes half-open.
+    """
+    self._lock.acquire()
+    try:
+      if self._state == CircuitBreaker.CLOSED:
+        return True
+      if time.time() >= self._retry_at:
+        ## backoff over (or the last probe never reported back): probe
+        self._set_state(CircuitBreaker.HALF_OPEN)
+        self._retry_at = time.time() + config['request_timeout']
+        return True
+      self._refused += 1
+      return False
+    finally:
+      self._lock.release()
+
+  def record_success(self):
+    """Note a successful request; closes the breaker."""
+    self._lock.acquire()
+    try:
+      self._failures = 0
+      self._openings = 0
+      if self._state != CircuitBreaker.CLOSED:
+        self._set_state(CircuitBreaker.CLOSED)
+        self._retry_at = None
+    finally:
+      self._lock.release()
+
+  def record_failure(self):
+    """Note a failed request; may open the breaker."""
+    self._lock.acquire()
+    try:
+      self._failures += 1
+      if self._state == CircuitBreaker.OPEN:   ## a request that was already under way
+        return
+      if self._state == CircuitBreaker.HALF_OPEN or self._failures >= config['breaker_failures']:
+        self._openings += 1
+        backoff = min(config['breaker_backoff'] * 2 ** (self._openings - 1), config['breaker_max_backoff'])
+        backoff *= 1 - config['breaker_jitter'] * random.random()
+        self._retry_at = time.time() + backoff
+        self._set_state(CircuitBreaker.OPEN)
+    finally:
+      self._lock.release()
+
+  def state(self):
+    """Return the breaker state: CircuitBreaker.CLOSED, OPEN or HALF_OPEN."""
+    return self._state
+
+  def retry_at(self):
+    """Return the datetime before which requests will be refused (None if the breaker is closed)."""
+    retry_at = self._retry_at
+    if self._state == CircuitBreaker.CLOSED or retry_at is None:
+      return None
+    return datetime.fromtimestamp(retry_at)
+
+  def report(self):
+    """Return (state, transitions, refused requests) and reset the counters."""
+    self._lock.acquire()
+    try:
+      r = (self._state, self._transitions, self._refused)
+      self._transitions = 0
+      self._refused = 0
+      return r
+    finally:
+      self._lock.release()
+
+  def _set_state(self, state):
+    """Change state.  Caller holds the lock."""
+    _log.info("Circuit breaker for %s: %s -> %s", self._host, self._state, state)
+    self._state = state
+    self._transitions += 1
+
+_circuit_breakers = {}
+"""CircuitBreakers keyed by host."""
+
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(host):
+  """Return the shared CircuitBreaker for a host, creating it if necessary."""
+  _circuit_breakers_lock.acquire()
+  try:
+    breaker = _circuit_breakers.get(host)
+    if breaker is None:
+      breaker = CircuitBreaker(host)
+      _circuit_breakers[host] = breaker
+    return breaker
+  finally:
+    _circuit_breakers_lock.release()
+
+def _http_get(url, deadline=None):
+  """Retrieve url over a pooled connection and return the body of the response.
+
+  Arguments:
+  url -- (string) full http:// url to retrieve
+  deadline -- Deadline bounding the request (default a new Deadline with configured budgets)
+
+  Raises IOError (including DeadlineExceeded) or httplib.HTTPException on failure.
+  """
+  (status, headers, body) = _http_request(url, deadline)
+  if status != 200:
+    raise IOError("HTTP %d retrieving %s" % (status, url))
+  return body
+
+def _http_request(url, deadline=None, headers=None, timings=None):
+  """Issue a GET for url over a pooled connection; return (status, response headers, body).
+
+  Arguments:
+  url -- (string) full http:// url to retrieve
+  deadline -- Deadline bounding the request (default a new Deadline with configured budgets)
+  headers -- optional dict of extra request headers (e.g. If-None-Match)
+  timings -- optional dict; seconds spent getting a connection and downloading 
+             the response are added to its 'connect' and 'download' entries
+
+  The response headers are an httplib.HTTPMessage.  Raises IOError (including 
+  DeadlineExceeded) or httplib.HTTPException on failure.  A request that fails 
+  on a reused connection (other than by timing out) is retried once on a fresh 
+  one.
+  """
+  if deadline is None:
+    deadline = Deadline()
+  parts = urlparse.urlsplit(url)
+  path = parts.path or "/"
+  if parts.query:
+    path += "?" + parts.query
+  pool = get_connection_pool(parts.hostname, parts.port)
+
+  if timings is None:
+    timings = {}
+  retried = False
+  while True:
+    start = time.time()
+    (conn, reused) = pool.acquire(deadline)
+    connected = time.time()
+    timings['connect'] = timings.get('connect', 0) + (connected - start)
+    try:
+      conn.sock.settimeout(deadline.read_timeout())
+      conn.request("GET", path, headers=headers or {})
+      response = conn.getresponse()
+
+      ## read in chunks so that a slow trickle of bytes can't run past the total budget
+      chunks = []
+      while True:
+        if conn.sock:
+          conn.sock.settimeout(deadline.read_timeout())
+        else:
+          deadline.remaining()
+        chunk = response.read(1024)
+        if not chunk:
+          break
+        chunks.append(chunk)
+    except DeadlineExceeded:
+      pool.release(conn, False)
+      raise
+    except (socket.error, httplib.HTTPException), e:
+      pool.release(conn, False)
+      timings['download'] = timings.get('download', 0) + (time.time() - connected)
+      if reused and not retried and not isinstance(e, socket.timeout):
+        ## the server has probably dropped our idle connections; start over
+        pool.discard_idle()
+        retried = True
+        continue
+      raise
+
+    pool.release(conn, not response.will_close)
+    timings['download'] = timings.get('download', 0) + (time.time() - connected)
+    return (response.status, response.msg, "".join(chunks))
+
+####################################
+def _run_concurrently(func, items, max_workers, key=None, max_per_key=None):
+  """Call func(item) for each item on a pool of threads; return results in item order.
+
+  Arguments:
+  func -- callable taking a single item
+  items -- list of items to process
+  max_workers -- maximum number of items processed at once
+  key -- optional callable mapping an item to a group (e.g. its host)
+  max_per_key -- maximum number of items from any one group processed at once
+
+  If any call raises, the first exception is re-raised once all calls have finished.
+  """
+  if max_workers <= 1 or len(items) <= 1:
+    return [func(item) for item in items]
+
+  ## interleave the groups so that workers spread out across hosts rather than
+  ##   queueing up behind a single group's limit
+  groups = {}
+  order = []
+  for (i, item) in enumerate(items):
+    k = key(item) if key else None
+    if k not in groups:
+      groups[k] = []
+      order.append(k)
+    groups[k].append(i)
+  work = Queue.Queue()
+  while groups:
+    for k in order:
+      if k in groups:
+        work.put(groups[k].pop(0))
+        if not groups[k]:
+          del groups[k]
+
+  limits = {}
+  if key and max_per_key:
+    for k in order:
+      limits[k] = threading.BoundedSemaphore(max_per_key)
+
+  results = [None] * len(items)
+  errors = []
+
+  def worker():
+    while True:
+      try:
+        i = work.get_nowait()
+      except Queue.Empty:
+        return
+      limit = limits.get(key(items[i])) if limits else None
+      if limit:
+        limit.acquire()
+      try:
+        results[i] = func(items[i])
+      except Exception:
+        errors.append(sys.exc_info())
+      finally:
+        if limit:
+          limit.release()
+
+  threads = [threading.Thread(target=worker) for n in range(min(max_workers, len(items)))]
+  for t in threads:
+    t.daemon = True
+    t.start()
+  for t in threads:
+    t.join()
+
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+  return results
+
+_MENU_LINK = re.compile(r"""<a\b[^>]*\bhref\s*=\s*["']?status\.html\?encid=([^"'\s>]+)[^>]*>(.*?)</a\s*>""", re.I | re.S)
+
+def _menu_modules(html, parser=None):
+  """Return (module name, label) pairs for the modules listed on a host's menu page.
+
+  Arguments:
+  html -- (string) contents of menu_noscript.html
+  parser -- 'fast' (precompiled patterns) or 'soup' (default config['parser'])
+  """
+  if parser is None:
+    parser = config['parser']
+  if parser == 'fast':
+    links = [(m, _tag_string(label)) for (m, label) in _MENU_LINK.findall(html)]
+  else:
+    links = []
+    for su in BeautifulSoup(html).findAll({'a' : True, 'target' : 'sensor'}):
+      m = re.match(r"status.html\?encid=(.+)", su.get('href', ""))
+      if m:
+        links.append((m.group(1), su.string))
+  return [(m, label) for (m, label) in links if m != "nbSensorSet_Alerting"]
+
+def get_sensor_modules(sensor_host):
+  """Return a list of connected sensor units on a given netbotz sensor host."""
+
+  ## look for connected sensor units
+  sensor_html = _http_get(sensor_host + "/pages/menu_noscript.html")
+  return [m for (m, label) in _menu_modules(sensor_html)]
+
+def scrape_sensor_module(sensor_host, sensor_module):
+  """Return list of SensorReadings from a specified host / sensor unit.
   
-  ## FIXMEs:
-  ##
-  ## * At most, db_id should be an optional argument (to save a db query) -- 
-  ##   there's no reason we can't query for the id from here.
-  
-  ## Private attributes
-  _sensor_name = None
-  """The string by which netbotz knows the sensor."""""
+  Arguments:
+  sensor_host -- (string) hostname or IP of netbotz unit
+  sensor_module -- name of the netbotz module to scrape.
+  """
+  html = _http_get(sensor_host + "/pages/status.html?encid=" + sensor_module)
+  reading_ts = datetime.now()
 
-  _module_name = None
-  """The display name of the parent sensor module."""
+  return parse_status_page(html, reading_ts)
+
+_adaptive_column = None
+"""Whether the sensor table has the adaptive_interval column (None until checked)."""
+
+def _adaptive_interval_sql(dbh, prefix=""):
+  """Return the SQL for a sensor's adaptive_interval: the column, or FALSE if the db predates it.
+
+  The column is looked for once per process; a missing one is logged.
+  """
+  global _adaptive_column
+  if _adaptive_column is None:
+    c = dbh.cursor()
+    try:
+      try:
+        c.execute("""SELECT adaptive_interval FROM sensor LIMIT 0""")
+        _adaptive_column = True
+      except MySQLdb.OperationalError, e:
+        if e.args[0] != 1054:             ## ER_BAD_FIELD_ERROR
+          raise
+        _log.warning("No sensor.adaptive_interval column in the db; treating it as unset for every sensor")
+        _adaptive_column = False
+    finally:
+      c.close()
+  if _adaptive_column:
+    return prefix + "adaptive_interval"
+  return "FALSE"
+
+def load_pool_config(dbh):
+  """Return the tracked host/module/sensor configuration, read with a single query.
+
+  Arguments:
+  dbh -- connected database handle to the db containing the sensor config
+
+  Returns a list of dicts, one per tracked sensor module, with keys host_id, 
+  host (as an http:// url), module_id, module_name, display_name and sensors.
+  sensors is a list of dicts with keys id, name, poll_interval, 
+  alert_threshold (None where the database leaves them unset) and 
+  adaptive_interval (False if the db has no such column).
+  """
+  adaptive = _adaptive_interval_sql(dbh, "s.")
+  c = dbh.cursor()
+  c.execute("""SELECT h.id, h.address, m.id, m.module_name, m.display_name,
+                      s.id, s.sensor_name, s.poll_interval, s.alert_threshold, %s
+               FROM host h
+               JOIN sensor_module m ON m.host = h.id AND m.track_data = TRUE
+               LEFT JOIN sensor s ON s.module = m.id AND s.track_data = TRUE
+               ORDER BY h.id, m.id, s.id""" % adaptive)
+  rows = c.fetchall()
+  c.close()
+
+  modules = []
+  for (host_id, address, module_id, module_name, display_name,
+       sensor_id, sensor_name, interval, threshold, adaptive) in rows:
+    if not modules or modules[-1]['module_id'] != module_id:
+      modules.append({'host_id': host_id,
+                      'host': "http://" + address,
+                      'module_id': module_id,
+                      'module_name': module_name,
+                      'display_name': display_name,
+                      'sensors': []})
+    if sensor_id is not None:             ## modules without tracked sensors still get a row
+      if threshold is not None:
+        threshold = float(threshold)
+      modules[-1]['sensors'].append({'id': sensor_id,
+                                     'name': sensor_name,
+                                     'poll_interval': interval,
+                                     'alert_threshold': threshold,
+                                     'adaptive_interval': bool(adaptive)})
+  return modules
+
+def config_fingerprint(dbh):
+  """Return a cheap checksum of the host/module/sensor config, for noticing when it changes.
+
+  A single aggregate query: the db does the work and only two numbers come 
+  back, where load_pool_config() transfers every row.  CONCAT_WS() skips 
+  NULLs, so nullable columns are given a placeholder to keep each field in 
+  its place.
+  """
+  adaptive = _adaptive_interval_sql(dbh, "s.")
+  c = dbh.cursor()
+  c.execute("""SELECT COUNT(*),
+                      SUM(CRC32(CONCAT_WS('|', h.id, h.address, m.id, m.module_name,
+                                          COALESCE(m.display_name, '\\\\N'), m.track_data,
+                                          s.id, s.sensor_name, s.track_data, COALESCE(s.poll_interval, '\\\\N'),
+                                          COALESCE(s.alert_threshold, '\\\\N'), %s)))
+               FROM host h
+               JOIN sensor_module m ON m.host = h.id
+               LEFT JOIN sensor s ON s.module = m.id""" % adaptive)
+  fingerprint = tuple(c.fetchone())
+  c.close()
+  return fingerprint
+
+def save_config_snapshot(path, pool_config, fingerprint=None):
+  """Save a sensor config to a local file, to start from without the db (see load_config_snapshot()).
+
+  Arguments:
+  path -- file to write; it is replaced atomically
+  pool_config -- list of module config dicts, as from load_pool_config()
+  fingerprint -- config_fingerprint() of the db the config was read from
+  """
+  if fingerprint is not None:
+    fingerprint = [v if v is None else int(v) for v in fingerprint]   ## SUM() arrives as a Decimal
+  f = open(path + ".tmp", "wb")
+  try:
+    ## latin-1 maps every byte to a character and back, so names round-trip 
+    ## unchanged whatever charset the db connection uses
+    json.dump({'fingerprint': fingerprint, 'modules': pool_config}, f, encoding="latin-1")
+  finally:
+    f.close()
+  os.rename(path + ".tmp", path)
+
+def load_config_snapshot(path):
+  """Return (pool_config, fingerprint) from a file written by save_config_snapshot()."""
+  f = open(path, "rb")
+  try:
+    snapshot = json.load(f)
+  finally:
+    f.close()
+  fingerprint = snapshot['fingerprint']
+  if fingerprint is not None:
+    fingerprint = tuple(fingerprint)
+  return (_from_json(snapshot['modules']), fingerprint)
+
+def _from_json(obj):
+  """Convert the unicode strings of a decoded save_config_snapshot() back to the original byte strings."""
+  if isinstance(obj, unicode):
+    return obj.encode("latin-1")
+  elif isinstance(obj, list):
+    return [_from_json(v) for v in obj]
+  elif isinstance(obj, dict):
+    return dict([(_from_json(k), _from_json(v)) for (k, v) in obj.iteritems()])
+  return obj
+
+class FleetDiscovery:
+  """Finds the sensor modules and sensors on many netbotz hosts and adds new ones to the config db.
+
+  Public methods:
+  inventory()
+  invalidate()
+  sync()
+
+  Hosts are listed concurrently, and each host's module list is cached for 
+  config['discovery_ttl'] seconds so that repeated syncs (e.g. from a 
+  periodic job) don't keep re-fetching unchanged appliances.  Only modules 
+  that aren't already in the db are scraped for their sensors.
+  """
 
-  _db_id = None
   _dbh = None
+  _ttl = None
+  _max_concurrency = None
 
-  _next_check_time = None
+  _inventory = None
+  """Dict mapping host address to (expiry time, list of (module name, label) pairs)."""
 
-  _poll_interval = None
-  """Specified in seconds, stored as timedelta."""
+  _lock = None
 
-  _alert_threshold = None
-  """Sensor values which change by more than this percentage alert regardless of time."""
-  
-  _current_reading = None
-  """A SensorReading object."""
+  def __init__(self, dbh, ttl=None, max_concurrency=None):
+    """Create a discovery helper for the given config database.
 
-  _previous_reading = None
-  """A SensorReading object."""
-  
-  def __init__(self, sensor_name, db_id, dbh):
-    """Initialize the sensor, setting up schedule & threshold based on config in the db.
-    
     Arguments:
-    sensor_name -- (string)
-    db_id -- id # of this module in the config database
     dbh -- connected database handle to the db containing the sensor config
+    ttl -- seconds a host's module list is cached (default config['discovery_ttl'])
+    max_concurrency -- hosts listed or modules scraped at once (default config['discovery_concurrency'])
     """
-    self._sensor_name = sensor_name
-    self._db_id = db_id
+    if ttl is None:
+      ttl = config['discovery_ttl']
+    if max_concurrency is None:
+      max_concurrency = config['discovery_concurrency']
     self._dbh = dbh
-    self._next_check_time = datetime.now()  ## set to check initially
+    self._ttl = ttl
+    self._max_concurrency = max_concurrency
+    self._inventory = {}
+    self._lock = threading.Lock()
 
-    c = self._dbh.cursor()
-    c.execute("""SELECT poll_interval, alert_threshold FROM sensor WHERE id = %s AND track_data = TRUE""", (self._db_id))
-    assert(c.rowcount == 1)
-    (interval, threshold) = c.fetchone()
-    c.close()
-    
-    if (interval is not None):
-      self._poll_interval = timedelta(0,interval)
-    else:
-      self._poll_interval = timedelta(0,config['default_interval'])
+  def inventory(self, addresses):
+    """Return a dict mapping each reachable host address to its list of (module name, label) pairs.
 
-    if (threshold is not None):
-      self._alert_threshold = threshold
-    else:
-      self._alert_threshold = config['default_threshold']
+    Hosts whose cached list has expired are listed again, concurrently.  
+    Unreachable hosts are left out (and not cached).
+    """
+    now = time.time()
+    self._lock.acquire()
+    try:
+      stale = [a for a in addresses if a not in self._inventory or self._inventory[a][0] < now]
+    finally:
+      self._lock.release()
 
-  def name(self):
-    """Return sensor name."""
-    return self._sensor_name
+    def list_modules(address):
+      try:
+        return _menu_modules(_http_get("http://" + address + "/pages/menu_noscript.html"))
+      except (IOError, httplib.HTTPException), e:
+        print "Could not list modules on %s: %s" % (address, e)
+        return None
 
-  def needs_check(self):
-    """Return True if this sensor is due for an update; otherwise False."""
-    if (self._poll_interval == 0) or (datetime.now() > self._next_check_time):
-      return True
+    results = _run_concurrently(list_modules, stale, self._max_concurrency)
+    self._lock.acquire()
+    try:
+      for (address, modules) in zip(stale, results):
+        if modules is not None:
+          self._inventory[address] = (now + self._ttl, modules)
+      return dict([(a, self._inventory[a][1]) for a in addresses if a in self._inventory])
+    finally:
+      self._lock.release()
 
-  def exceeds_threshold(self, new_reading):
-    """Return True if new reading is +/- the last reading by > the alert threshold.  
+  def invalidate(self, address=None):
+    """Forget the cached module list of a host (or of every host)."""
+    self._lock.acquire()
+    try:
+      if address is None:
+        self._inventory = {}
+      else:
+        self._inventory.pop(address, None)
+    finally:
+      self._lock.release()
+
+  def sync(self, addresses=None):
+    """Add hosts, modules and sensors found on the network but missing from the db.
 
     Arguments:
-    new_reading -- a SensorReading object
+    addresses -- host addresses (as in the host table) to examine; any not yet in 
+                 the db are added.  Default: every host in the db.
 
-    Usage note: This should be called _before_ the update() method is called.  It would 
-    normally be used to determine if update() should be called.
+    New modules are scraped (concurrently) for their sensors, then added with 
+    their menu label as display name and their sensors with the db's default 
+    settings.  A module that can't be scraped isn't added, so the next sync 
+    tries it again.  Returns a list of (address, module name, list of sensor 
+    names) for each module added.
     """
-    if (self._alert_threshold == 0):
-      return False
-    if (self._current_reading is None):  # special case for first pass
-      return True
-    if re.match(r"N\/A", str(new_reading.value())):  # special case for disconnected sensors yielding "N/A"
-      return False      
-    if ((new_reading.value() > (self._current_reading.value()             
-                               + (self._current_reading.value() * self._alert_threshold)))     
-        or (new_reading.value() < (self._current_reading.value()
-                              - (self._current_reading.value() * self._alert_threshold)))):
-      #print "DEBUG:  Alerting due to threshold variance!"
-      return True
+    c = self._dbh.cursor()
+    c.execute("""SELECT id, address FROM host""")
+    hosts = dict([(address, host_id) for (host_id, address) in c.fetchall()])
+    if addresses is None:
+      addresses = sorted(hosts.keys())
+
+    new_hosts = [a for a in addresses if a not in hosts]
+    if new_hosts:
+      c.executemany("""INSERT INTO host (address) VALUES (%s)""", [(a,) for a in new_hosts])
+      c.execute("""SELECT id, address FROM host""")
+      hosts = dict([(address, host_id) for (host_id, address) in c.fetchall()])
+
+    c.execute("""SELECT host, module_name FROM sensor_module""")
+    known = set(c.fetchall())
+    found = self.inventory(addresses)
+    new_modules = []
+    for address in addresses:
+      for (module_name, label) in found.get(address, []):
+        if (hosts[address], module_name) not in known:
+          new_modules.append((address, module_name, label))
+    if not new_modules:
+      self._dbh.commit()
+      c.close()
+      return []
+
+    def scrape(module):
+      try:
+        return [r.key() for r in scrape_sensor_module("http://" + module[0], module[1])]
+      except (IOError, httplib.HTTPException, ValueError), e:
+        print "Could not scrape %s on %s: %s" % (module[1], module[0], e)
+        return None
+
+    sensors = _run_concurrently(scrape, new_modules, self._max_concurrency,
+                                key=lambda module: module[0], max_per_key=config['max_per_host'])
+    scraped = [(module, names) for (module, names) in zip(new_modules, sensors) if names is not None]
+    if scraped:
+      c.executemany("""INSERT INTO sensor_module (host, module_name, display_name) VALUES (%s, %s, %s)""",
+                    [(hosts[a], m, label) for ((a, m, label), names) in scraped])
+    c.execute("""SELECT id, host, module_name FROM sensor_module""")
+    module_ids = dict([((host_id, m), module_id) for (module_id, host_id, m) in c.fetchall()])
+
+    rows = []
+    added = []
+    for ((address, module_name, label), names) in scraped:
+      module_id = module_ids[(hosts[address], module_name)]
+      rows.extend([(module_id, n) for n in names])
+      added.append((address, module_name, names))
+    if rows:
+      c.executemany("""INSERT INTO sensor (module, sensor_name) VALUES (%s, %s)""", rows)
+    self._dbh.commit()
+    c.close()
+    return added
+
+_LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 
+                    1, 2, 5, 10, 20, 30, 60)
+"""Upper bounds (in seconds) of the LatencyHistogram buckets."""
+
+class LatencyHistogram:
+  """Fixed-bucket histogram of durations.
+
+  Public methods:
+  record(seconds)
+  merge(other)
+  count()
+  mean()
+  percentile(p)
+
+  Durations are counted in the buckets of _LATENCY_BUCKETS (plus one for 
+  anything longer), so recording is cheap and histograms can be merged.  
+  Percentiles are reported as the upper bound of the bucket they fall in, 
+  capped at the longest duration seen.
+  """
+
+  _counts = None
+  _total = 0.0
+  _max = 0.0
+
+  def __init__(self):
+    self._counts = [0] * (len(_LATENCY_BUCKETS) + 1)
+
+  def record(self, seconds):
+    """Add a single duration (in seconds)."""
+    i = 0
+    while i < len(_LATENCY_BUCKETS) and seconds > _LATENCY_BUCKETS[i]:
+      i += 1
+    self._counts[i] += 1
+    self._total += seconds
+    self._max = max(self._max, seconds)
+
+  def merge(self, other):
+    """Add the durations recorded in another LatencyHistogram to this one."""
+    for i in range(len(self._counts)):
+      self._counts[i] += other._counts[i]
+    self._total += other._total
+    self._max = max(self._max, other._max)
+
+  def count(self):
+    """Return the number of durations recorded."""
+    return sum(self._counts)
+
+  def mean(self):
+    """Return the mean duration in seconds (None if nothing has been recorded)."""
+    n = self.count()
+    if n == 0:
+      return None
+    return self._total / n
+
+  def percentile(self, p):
+    """Return an upper bound on the p'th percentile duration (p from 0 to 100), or None."""
+    n = self.count()
+    if n == 0:
+      return None
+    rank = n * p / 100.0
+    seen = 0
+    for i in range(len(_LATENCY_BUCKETS)):
+      seen += self._counts[i]
+      if seen >= rank:
+        return min(_LATENCY_BUCKETS[i], self._max)
+    return self._max
+
+_TIMING_PHASES = ('connect', 'download', 'parse', 'evaluate')
+"""Phases of a module check timed by SensorModuleChecker."""
+
+def _timing_readings(histograms, display_prefix):
+  """Return p50/p95/p99 SensorReadings for a dict of LatencyHistograms keyed by phase."""
+  r = []
+  for phase in _TIMING_PHASES:
+    h = histograms.get(phase)
+    if h is None or h.count() == 0:
+      continue
+    for p in (50, 95, 99):
+      reading = SensorReading(datetime.now(), display_prefix)
+      reading.set("%s_p%d" % (phase, p), h.percentile(p))
+      r.append(reading)
+  return r
+
+def _pool_timing_readings(timings):
+  """Return per-host and pool-wide timing SensorReadings for a dict of LatencyHistograms keyed by (host, phase)."""
+  by_host = {}
+  overall = {}
+  for ((host, phase), h) in timings.iteritems():
+    by_host.setdefault(host, {})[phase] = h
+    overall.setdefault(phase, LatencyHistogram()).merge(h)
+
+  r = []
+  for host in sorted(by_host.keys()):
+    r.extend(_timing_readings(by_host[host], re.sub(r"^\w+://", "", host) + "-"))
+  r.extend(_timing_readings(overall, "all-"))
+  return r
+
+class CheckerPool:
+  """A simple collection of SensorModuleChecker instances.
   
-  def update(self, new_reading):
-    """Takes new SensorReading for this sensor, updates sensor based on its value. Returns nothing.
+  Public methods:
+  apply_config()
+  check()
+  check_modules()
+  export_state()
+  fingerprint()
+  generation()
+  health_report()
+  modules()
+  reload()
+  restore_checkpoint()
+  restore_state()
+  take_timings()
+  timing_report()
 
-    Side Effects: updates last_reading and _current_reading members, refreshes _next_check_time
-    """
-    self._previous_reading = self._current_reading
-    self._current_reading = new_reading
+  Modules are polled serially unless max_concurrency is greater than 1, in 
+  which case they are polled from a pool of threads so that a sweep takes 
+  about as long as the slowest module rather than the sum of all of them.
 
-    ### Important Note:  if we're polling more slowly than we're scheduled to, this time may be in the past.  That is by 
-    ###    design, though the alternatives (where next_check = now + _poll_interval or where 
-    ###   next_check = last_check_time + _poll_interval) are not insane.
-    self._next_check_time = self._next_check_time + self._poll_interval
+  Given a snapshot path, the pool starts from the config saved there (see 
+  save_config_snapshot()) without touching the db, and keeps it up to date 
+  on every reload() or apply_config(), so startup needn't wait on MySQL.  
+  Polling and reloading hold the pool's lock, so a reload is applied 
+  between sweeps.
+  """
 
-  def get_data_update(self):
-    """Returns a SensorReading if alert critera were satisfied."""
+  _SMC = None   
+  """List of SensorModuleCheckers."""
+  
+  _dbh = None
 
-    ## Only alert if the value has changed
-    if  (self._previous_reading is None         # first time through
-        or self._current_reading.value() != self._previous_reading.value()):
-      return self._current_reading 
-  
\ No newline at end of file
+  _max_concurrency = None
+  """Maximum number of modules polled at once."""
+
+  _max_per_host = None
+  """Maximum number of modules on a single host polled at once."""
+
+  _timings = None
+  """Dict of LatencyHistograms keyed by (host, phase), reset with each timing_report()."""
+
+  _next_self_report = None
+
+  _evaluator = None
+  """BatchEvaluator for all sensors in the pool (built on first use with config['batch_evaluation'])."""
+
+  _self_reporting = True
+  """False if the pool's health and timing reports are left to the caller."""
+
+  _fingerprint = None
+  """config_fingerprint() of the config last loaded from the db."""
+
+  _generation = 0
+  """Incremented whenever reload() changes the pool."""
+
+  _snapshot = None
+  """Path of the local config snapshot, if any."""
+
+  _lock = None
+  """Held while polling and while applying a reload."""
+
+  _reload_lock = None
+  """Held for the whole of a reload(), so reloads from two threads don't interleave."""
+
+  _index = None
+  """LatestValueIndex the modules record their readings in, if any."""
+
+  _pipeline = None
+  """PipelinedPoller for the pool's modules (started on first use with config['pipeline'])."""
+
+  def __init__(self, dbh, max_concurrency=None, max_per_host=None, pool_config=None, self_report=True,
+               snapshot=None, index=None):
+    """Create new CheckerPool tied to the given database.
+    
+    Arguments:
+    dbh -- connected database handle to the db containing the sensor config
+    max_concurrency -- modules polled at once (default config['max_concurrency'])
+    max_per_host -- modules on one host polled at once (default config['max_per_host'])
+    pool_config -- optional list of module config dicts (as from load_pool_config()); 
+                   if given, the db is not queried
+    self_report -- if False, check() never includes the health_report() and 
+                   timing_report() readings (see ShardedCheckerPool)
+    snapshot -- optional path of a config snapshot; if the file exists the pool 
+                starts from it (dbh may be None), otherwise it is written from 
+                the db config
+    index -- optional LatestValueIndex to keep the latest reading of every sensor in
+    """
+    
+    self._SMC = []
+    self._dbh = dbh
+    self._snapshot = snapshot
+    self._index = index
+    self._lock = threading.RLock()
+    self._reload_lock = threading.Lock()
+    if max_concurrency is None:
+      max_concurrency = config['max_concurrency']
+    if max_per_host is None:
+      max_per_host = config['max_per_host']
+    self._max_concurrency = max_concurrency
+    self._max_per_host = max_per_host
+    self._timings = {}
+    self._next_self_report = datetime.now() + timedelta(0, config['self_report_interval'])
+    self._self_reporting = self_report
+    self._initialize_pool(pool_config)
+    
+  def _initialize_pool(self, pool_config=None):
+    """Create SensorModuleChecker objects for each module defined in the database (or in 
+    pool_config) and add to the pool."""
+    
+    if pool_config is None and self._snapshot is not None and os.path.exists(self._snapshot):
+      (pool_config, self._fingerprint) = load_config_snapshot(self._snapshot)
+    elif pool_config is None:
+      self._fingerprint = config_fingerprint(self._dbh)
+      pool_config = load_pool_config(self._dbh)
+      self._save_snapshot(pool_config, self._fingerprint)
+    for m in pool_config:
+      smc = SensorModuleChecker(m['host'], m['module_name'], m['display_name'], m['module_id'], 
+                                self._dbh, m['sensors'], self._index)
+      self._SMC.append(smc)
+    
+  def check(self):
+    """Check all sensors, return list of alerting SensorReadings."""
+    return self.check_modules(self._SMC)
+
+  def check_modules(self, modules):
+    """Check the given SensorModuleCheckers from this pool, return list of alerting SensorReadings."""
+    self._lock.acquire()
+    try:
+      if config['pipeline']:
+        return self._check_modules_pipelined(modules)
+      if config['batch_evaluation']:
+        return self._check_modules_batch(modules)
+
+      new_alerts = []
+      results = _run_concurrently(lambda smc: smc.check(), modules, self._max_concurrency,
+                                  key=lambda smc: smc.host(), max_per_key=self._max_per_host)
+      for alerts in results:
+        new_alerts.extend(alerts) 
+      new_alerts.extend(self._record_timings(modules))
+      return new_alerts
+    finally:
+      self._lock.release()
+
+  def _check_modules_pipelined(self, modules):
+    """Like check_modules(), but with fetching, parsing and evaluation overlapped by a PipelinedPoller."""
+    if self._pipeline is None:
+      self._pipeline = PipelinedPoller(self._max_concurrency, max_per_host=self._max_per_host)
+    new_alerts = self._pipeline.check_modules(modules)
+    new_alerts.extend(self._record_timings(modules))
+    return new_alerts
+
+  def _check_modules_batch(self, modules):
+    """Like check_modules(), but evaluate every sensor of the sweep in one BatchEvaluator pass."""
+    results = _run_concurrently(lambda smc: smc.poll(), modules, self._max_concurrency,
+                                key=lambda smc: smc.host(), max_per_key=self._max_per_host)
+    if self._evaluator is None:
+      sensors = []
+      for smc in self._SMC:
+        sensors.extend(smc.sensors())
+      self._evaluator = BatchEvaluator(sensors)
+
+    updates = []
+    for (smc, sensorReadings) in zip(modules, results):
+      if sensorReadings is None:
+        continue
+      for s in smc.sensors():
+        r = sensorReadings.get(s.name())
+        if r is not None:
+          updates.append((s, r))
+    start = time.time()
+    new_alerts = self._evaluator.evaluate(updates)
+    self._timings.setdefault(("pool", "evaluate"), LatencyHistogram()).record(time.time() - start)
+
+    for (smc, sensorReadings) in zip(modules, results):
+      if sensorReadings is not None:
+        new_alerts.extend(smc.self_report_if_due())
+    new_alerts.extend(self._record_timings(modules))
+    return new_alerts
+
+  def _record_timings(self, modules):
+    """Add the phase timings of the modules just checked; return the timing report if one is due.
+
+    Like the modules' own histograms, only successful fetches are recorded.
+    """
+    new_alerts = []
+    for smc in modules:
+      if smc.last_fetch_failed():
+        continue
+      for (phase, seconds) in smc.last_timings().iteritems():
+        if (smc.host(), phase) not in self._timings:
+          self._timings[(smc.host(), phase)] = LatencyHistogram()
+        self._timings[(smc.host(), phase)].record(seconds)
+    if self._self_reporting and datetime.now() > self._next_self_report:
+      new_alerts.extend(self.health_report())
+      new_alerts.extend(self.timing_report())
+      if self._pipeline is not None:
+        new_alerts.extend(self._pipeline.report())
+    return new_alerts
+
+  def health_report(self):
+    """Return SensorReadings on the CircuitBreaker of each host in the pool.
+
+    For each host, <host>-circuit_open is 1 if polling is suspended (the 
+    breaker is open or half-open) and 0 otherwise, <host>-circuit_transitions
+    counts state changes and <host>-circuit_refused counts polls skipped since 
+    the last report.
+
+    Side effects: resets the breakers' counters.
+    """
+    r = []
+    for host in sorted(set([smc.host() for smc in self._SMC])):
+      (state, transitions, refused) = get_circuit_breaker(host).report()
+      prefix = re.sub(r"^\w+://", "", host) + "-"
+      for (key, value) in (("circuit_open", int(state != CircuitBreaker.CLOSED)),
+                           ("circuit_transitions", transitions),
+                           ("circuit_refused", refused)):
+        reading = SensorReading(datetime.now(), prefix)
+        reading.set(key, value)
+        r.append(reading)
+    return r
+
+  def timing_report(self):
+    """Return SensorReadings with per-host and pool-wide phase timing percentiles.
+
+    Readings are named <host>-<phase>_p<N> and all-<phase>_p<N>.
+
+    Side effects: resets the timing histograms and the self-report timer.
+    """
+    r = _pool_timing_readings(self._timings)
+    self._timings = {}
+    self._next_self_report = datetime.now() + timedelta(0, config['self_report_interval'])
+    return r
+
+  def reload(self, dbh=None):
+    """Re-read the sensor config and apply only what changed; return True if anything did.
+
+    Arguments:
+    dbh -- connected database handle (default the pool's own)
+
+    Nothing more than config_fingerprint() is queried if the config is 
+    unchanged.  Otherwise modules and sensors no longer tracked are dropped, 
+    new ones are added, and changed settings are applied to the existing 
+    SensorCheckers, so sensors keep their readings and schedules (see 
+    SensorModuleChecker.reconfigure()).  A module whose host, name or display 
+    name changed is replaced, with its sensors' state carried over.  The db 
+    is queried before taking the pool's lock, so a slow db doesn't hold up 
+    polling; concurrent reloads run one at a time.
+    """
+    if dbh is None:
+      dbh = self._dbh
+    self._reload_lock.acquire()
+    try:
+      fingerprint = config_fingerprint(dbh)
+      if fingerprint == self._fingerprint:
+        return False
+      return self.apply_config(load_pool_config(dbh), fingerprint)
+    finally:
+      self._reload_lock.release()
+
+  def apply_config(self, pool_config, fingerprint=None):
+    """Apply a sensor config read from the db, as reload() does; return True if anything changed.
+
+    Arguments:
+    pool_config -- list of module config dicts, as from load_pool_config()
+    fingerprint -- config_fingerprint() of the db the config was read from
+
+    For a caller which reads the config itself (e.g. away from the polling 
+    thread, see PollingDaemon).
+    """
+    self._lock.acquire()
+    try:
+      changed = self._apply_config(pool_config)
+      self._fingerprint = fingerprint
+    finally:
+      self._lock.release()
+    self._save_snapshot(pool_config, fingerprint)
+    return changed
+
+  def fingerprint(self):
+    """Return the config_fingerprint() of the config the pool was last loaded from (None if unknown)."""
+    return self._fingerprint
+
+  def _save_snapshot(self, pool_config, fingerprint):
+    """Rewrite the config snapshot, if the pool keeps one; a failure is logged, not raised."""
+    if self._snapshot is None:
+      return
+    try:
+      save_config_snapshot(self._snapshot, pool_config, fingerprint)
+    except (IOError, OSError), e:
+      _log.error("Config snapshot failed: %s", e)
+
+  def _apply_config(self, pool_config):
+    """Diff a list of module config dicts against the pool and apply it; return True if anything changed."""
+    current = dict([(smc.db_id(), smc) for smc in self._SMC])
+    changed = len(pool_config) != len(self._SMC)
+    modules = []
+    for m in pool_config:
+      smc = current.get(m['module_id'])
+      if smc is None or smc.identity() != (m['host'], m['module_name'], m['display_name'] or m['module_name']):
+        new_smc = SensorModuleChecker(m['host'], m['module_name'], m['display_name'], m['module_id'],
+                                      self._dbh, m['sensors'], self._index)
+        if smc is not None:
+          states = dict([(s.db_id(), s.export_state()) for s in smc.sensors()])
+          for s in new_smc.sensors():
+            if s.db_id() in states:
+              s.restore_state(states[s.db_id()])
+        smc = new_smc
+        changed = True
+      elif smc.reconfigure(m['sensors']):
+        changed = True
+      modules.append(smc)
+    self._SMC = modules
+    if changed:
+      self._evaluator = None
+      self._generation += 1
+      if self._index is not None:
+        self._index.retain([smc.identity()[:2] for smc in modules])
+    return changed
+
+  def generation(self):
+    """Return a number which changes whenever reload() changes the pool's modules or sensors."""
+    return self._generation
+
+  def take_timings(self):
+    """Return the dict of LatencyHistograms keyed by (host, phase), and start a new one."""
+    (timings, self._timings) = (self._timings, {})
+    return timings
+
+  def modules(self):
+    """Return the list of SensorModuleCheckers in the pool."""
+    return self._SMC
+
+  def export_state(self):
+    """Return a dict of each sensor's state (see SensorChecker.export_state()) keyed by sensor db id."""
+    states = {}
+    self._lock.acquire()
+    try:
+      for smc in self._SMC:
+        for s in smc.sensors():
+          states[s.db_id()] = s.export_state()
+    finally:
+      self._lock.release()
+    return states
+
+  def restore_state(self, states):
+    """Restore sensor states from a dict returned by export_state(); sensors not in it are untouched."""
+    self._lock.acquire()
+    try:
+      for smc in self._SMC:
+        for s in smc.sensors():
+          if s.db_id() in states:
+            s.restore_state(states[s.db_id()])
+      self._evaluator = None
+    finally:
+      self._lock.release()
+
+  def restore_checkpoint(self, checkpoint):
+    """Restore sensor states from a Checkpoint (see write_checkpoint()); sensors not in it are untouched.
+
+    Sensors which were due while nothing was running are due at once; the 
+    rest pick up their schedule where it left off, and none alerts on its 
+    first reading merely for being the first.
+    """
+    self._lock.acquire()
+    try:
+      for smc in self._SMC:
+        smc.restore_checkpoint(checkpoint)
+      self._evaluator = None
+    finally:
+      self._lock.release()
+
+class Scheduler:
+  """Polls the modules of a CheckerPool only when one of their sensors is due.
+
+  Public methods:
+  run_pending()
+  next_deadline()
+  run(handler)
+
+  Rather than fetching every module on every CheckerPool.check(), the 
+  scheduler keeps a heap of module due times (see 
+  SensorModuleChecker.next_due()), fetches only the modules whose time has 
+  come, and sleeps until the earliest remaining deadline.  If the pool is 
+  reloaded (see CheckerPool.reload()), the heap is rebuilt from the pool's 
+  new modules.
+  """
+
+  _pool = None
+  _heap = None
+  """Heap of (due time, sequence #, SensorModuleChecker)."""
+
+  _seq = None
+
+  _generation = None
+  """The pool's generation() when the heap was built."""
+
+  def __init__(self, pool):
+    """Create a scheduler for the modules of the given CheckerPool."""
+    self._pool = pool
+    self._seq = itertools.count()
+    self._rebuild()
+
+  def _rebuild(self):
+    """Schedule every module of the pool afresh."""
+    self._generation = self._pool.generation()
+    self._heap = []
+    for smc in self._pool.modules():
+      self._schedule(smc)
+
+  def _check_generation(self):
+    """Rebuild the heap if the pool has been reloaded since it was built."""
+    if self._pool.generation() != self._generation:
+      self._rebuild()
+
+  def _schedule(self, smc):
+    due = smc.next_due()
+    if due is not None:                   ## modules without sensors are never due
+      heapq.heappush(self._heap, (due, self._seq.next(), smc))
+
+  def next_deadline(self):
+    """Return the datetime at which the next module is due, or None if nothing is scheduled."""
+    self._check_generation()
+    if self._heap:
+      return self._heap[0][0]
+    return None
+
+  def run_pending(self, now=None):
+    """Check every module that is due, return list of alerting SensorReadings."""
+    if now is None:
+      now = datetime.now()
+    self._check_generation()
+    due = []
+    while self._heap and self._heap[0][0] <= now:
+      due.append(heapq.heappop(self._heap)[2])
+    if not due:
+      return []
+    try:
+      return self._pool.check_modules(due)
+    finally:
+      for smc in due:
+        self._schedule(smc)
+
+  def run(self, handler, stop=None):
+    """Check modules as they come due until stopped, passing each batch of alerts to handler.
+
+    Arguments:
+    handler -- callable taking a list of alerting SensorReadings
+    stop -- optional threading.Event; the loop exits once it is set
+    """
+    while not (stop and stop.is_set()):
+      alerts = self.run_pending()
+      if alerts:
+        handler(alerts)
+      deadline = self.next_deadline()
+      if deadline is None:
+        delay = config['threshold_poll_interval']
+      else:
+        delay = max(0, _total_seconds(deadline - datetime.now()))
+      if stop:
+        stop.wait(delay)
+      else:
+        time.sleep(delay)
+
+def _total_seconds(td):
+  """Return a timedelta as float seconds (timedelta.total_seconds() is new in python 2.7)."""
+  return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / float(10**6)
+
+def _shard_of(host_id, shards):
+  """Return the shard (0 to shards - 1) for a host id; the same in every process and every run."""
+  return (zlib.crc32(str(host_id)) & 0xffffffff) % shards
+
+def _shard_worker(conn, pool_config, states, max_concurrency, max_per_host, index=False):
+  """Run a ShardedCheckerPool worker: a CheckerPool answering requests from conn until told to stop.
+
+  Every reply is (status, result, state, latest), where state is the pool's 
+  exported sensor state every config['shard_state_interval'] seconds (and on 
+  stop), else None, and latest is the list of LatestValueIndex entries 
+  updated by the request if index is True, else None.
+  """
+  ## a worker started by PollingDaemon would inherit its handlers; leave SIGINT to the parent
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  signal.signal(signal.SIGHUP, signal.SIG_DFL)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  latest = None
+  if index:
+    latest = LatestValueIndex(record_updates=True)
+  pool = CheckerPool(None, max_concurrency, max_per_host, pool_config, self_report=False, index=latest)
+  pool.restore_state(states)
+  scheduler = None
+  next_export = time.time() + config['shard_state_interval']
+  while True:
+    try:
+      request = conn.recv()
+    except (EOFError, IOError):
+      return                              ## the parent has gone away
+    try:
+      if request == 'stop':
+        conn.send(('ok', None, pool.export_state(), None))
+        return
+      elif request == 'check':
+        result = pool.check()
+      elif request == 'run_pending':
+        if scheduler is None:
+          scheduler = Scheduler(pool)
+        result = (scheduler.run_pending(), scheduler.next_deadline())
+      elif request == 'report':
+        result = (pool.health_report(), pool.take_timings())
+      else:
+        raise ValueError("Unknown request %r" % (request,))
+      state = None
+      if time.time() >= next_export:
+        state = pool.export_state()
+        next_export = time.time() + config['shard_state_interval']
+      conn.send(('ok', result, state, _take_updates(latest)))
+    except Exception, e:
+      conn.send(('error', "%s: %s" % (e.__class__.__name__, e), None, _take_updates(latest)))
+
+def _take_updates(index):
+  """Return index.take_updates(), or None if there is no index."""
+  if index is None:
+    return None
+  return index.take_updates()
+
+class ShardedCheckerPool:
+  """Polls the modules of the sensor config from several worker processes.
+
+  Public methods:
+  check()
+  run_pending()
+  next_deadline()
+  export_state()
+  restarts()
+  close()
+
+  Parsing is CPU-bound, so a single process (however many threads it 
+  polls from) is limited to one core.  Here hosts are partitioned across 
+  worker processes by a CRC of their db id, so a host always lands on the 
+  same worker, and each worker runs its own CheckerPool (with its own 
+  connection pools and circuit breakers).  The parent hands out requests, 
+  collects the alerts and produces the pool-wide self-report.
+
+  Workers send back their sensor state every config['shard_state_interval']
+  seconds.  A worker which dies is restarted from the last state it sent, so 
+  schedules and last readings survive (less whatever changed since).
+  """
+
+  _configs = None
+  """List of the module config dicts for each shard."""
+
+  _states = None
+  """List of the last sensor state received from each shard."""
+
+  _workers = None
+  """List of (Process, Connection) for each shard."""
+
+  _deadlines = None
+  """List of the next deadline reported by each shard's Scheduler."""
+
+  _timeouts = None
+  """List of the seconds each shard's worker has to answer a request before it is restarted."""
+
+  _max_concurrency = None
+  _max_per_host = None
+  _index = None
+  _restarts = 0
+  _next_self_report = None
+  _closed = False
+
+  def __init__(self, dbh, shards=None, max_concurrency=None, max_per_host=None, pool_config=None,
+               states=None, checkpoint=None, index=None):
+    """Start the worker processes.
+
+    Arguments:
+    dbh -- connected database handle to the db containing the sensor config
+    shards -- number of worker processes (default config['shards'], or one per CPU if that is None)
+    max_concurrency -- modules polled at once by each worker (default config['max_concurrency'])
+    max_per_host -- modules on one host polled at once (default config['max_per_host'])
+    pool_config -- optional list of module config dicts (as from load_pool_config()); 
+                   if given, the db is not queried
+    states -- optional dict of sensor states to start from (as from export_state())
+    checkpoint -- optional path of a checkpoint file (see write_checkpoint()) to start 
+                  from; states takes precedence over it
+    index -- optional LatestValueIndex to keep the latest reading of every sensor in; 
+             the workers send their updates back with each reply
+    """
+    if shards is None:
+      shards = config['shards'] or multiprocessing.cpu_count()
+    if pool_config is None:
+      pool_config = load_pool_config(dbh)
+    self._max_concurrency = max_concurrency
+    self._max_per_host = max_per_host
+    self._index = index
+    self._configs = [[] for n in range(shards)]
+    for m in pool_config:
+      self._configs[_shard_of(m['host_id'], shards)].append(m)
+    self._timeouts = [self._request_timeout(modules) for modules in self._configs]
+    if index is not None:
+      index.retain([(m['host'], m['module_name']) for m in pool_config])
+    self._states = [dict(states or {}) for n in range(shards)]
+    if checkpoint is not None:
+      ## seed the states the parent hands out (and exports) from the checkpoint, so 
+      ## that until a worker first sends its own they aren't empty
+      c = Checkpoint(checkpoint)
+      try:
+        for (i, modules) in enumerate(self._configs):
+          for m in modules:
+            prefix = (m['display_name'] or m['module_name']) + "-"
+            for sensor in m['sensors']:
+              record = c.get(sensor['id'])
+              if record is not None and sensor['id'] not in self._states[i]:
+                self._states[i][sensor['id']] = _checkpoint_state(record, sensor['name'], prefix)
+      finally:
+        c.close()
+    self._workers = [None] * shards
+    self._deadlines = [datetime.now()] * shards
+    for i in range(shards):
+      self._start(i)
+    self._next_self_report = datetime.now() + timedelta(0, config['self_report_interval'])
+    atexit.register(self.close)
+
+  def _start(self, i):
+    (conn, worker_conn) = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_shard_worker,
+                                args=(worker_conn, self._configs[i], self._states[i],
+                                      self._max_concurrency, self._max_per_host,
+                                      self._index is not None))
+    p.daemon = True
+    p.start()
+    worker_conn.close()
+    self._workers[i] = (p, conn)
+
+  def _restart(self, i):
+    (p, conn) = self._workers[i]
+    if p.is_alive():
+      p.terminate()
+      p.join(5)
+      if p.is_alive():                    ## wedged past the point of handling SIGTERM
+        os.kill(p.pid, signal.SIGKILL)
+    p.join()
+    conn.close()
+    self._restarts += 1
+    self._deadlines[i] = datetime.now()
+    self._start(i)
+
+  def _request_timeout(self, modules):
+    """Return the seconds a worker may take to answer a request to check all of the given modules.
+
+    That is a config['request_timeout'] for each round of fetches the 
+    worker needs if every one of them runs out of time, given its 
+    concurrency and per-host limits, plus one for parsing and the rest.
+    """
+    concurrency = max(1, self._max_concurrency or config['max_concurrency'])
+    per_host = max(1, self._max_per_host or config['max_per_host'])
+    hosts = {}
+    for m in modules:
+      hosts[m['host']] = hosts.get(m['host'], 0) + 1
+    rounds = -(-len(modules) // concurrency)
+    for n in hosts.itervalues():
+      rounds = max(rounds, -(-n // per_host))
+    return config['request_timeout'] * (rounds + 1)
+
+  def _request(self, request):
+    """Send a request to every worker; return their results (None for a worker that failed).
+
+    A worker which dies, or doesn't answer within its timeout (see 
+    _request_timeout()), is restarted.
+    """
+    start = time.time()
+    for (p, conn) in self._workers:
+      try:
+        conn.send(request)
+      except (IOError, OSError):
+        pass                              ## noticed when the reply doesn't come
+    results = []
+    for i in range(len(self._workers)):
+      (p, conn) = self._workers[i]
+      try:
+        while not conn.poll(1):
+          if not p.is_alive():
+            raise EOFError("worker died")
+          if time.time() > start + self._timeouts[i]:
+            raise EOFError("no answer in %d s" % self._timeouts[i])
+        (status, result, state, latest) = conn.recv()
+      except (EOFError, IOError, OSError), e:
+        _log.warning("Shard %d worker failed (%s); restarting it.", i, e)
+        self._restart(i)
+        results.append(None)
+        continue
+      if state is not None:
+        self._states[i] = state
+      if latest:
+        self._index.merge(latest)
+      if status != 'ok':
+        _log.error("Shard %d error: %s", i, result)
+        result = None
+      results.append(result)
+    return results
+
+  def check(self):
+    """Check all sensors on every shard, return list of alerting SensorReadings."""
+    new_alerts = []
+    for alerts in self._request('check'):
+      new_alerts.extend(alerts or [])
+    new_alerts.extend(self._self_report_if_due())
+    return new_alerts
+
+  def run_pending(self):
+    """Have each shard check the modules that are due (see Scheduler), return list of alerting SensorReadings."""
+    new_alerts = []
+    for (i, result) in enumerate(self._request('run_pending')):
+      if result is None:
+        self._deadlines[i] = datetime.now()
+        continue
+      (alerts, self._deadlines[i]) = result
+      new_alerts.extend(alerts)
+    new_alerts.extend(self._self_report_if_due())
+    return new_alerts
+
+  def next_deadline(self):
+    """Return the earliest deadline reported by the shards' Schedulers (None if nothing is scheduled)."""
+    deadlines = [d for d in self._deadlines if d is not None]
+    if deadlines:
+      return min(deadlines)
+    return None
+
+  def restarts(self):
+    """Return the number of times a worker has been restarted."""
+    return self._restarts
+
+  def export_state(self):
+    """Return a dict of sensor states keyed by sensor db id, as last sent by the workers.
+
+    After close(), this is the state the workers had when they stopped.
+    """
+    states = {}
+    for shard_states in self._states:
+      states.update(shard_states)
+    return states
+
+  def close(self):
+    """Stop the workers."""
+    if self._closed:
+      return
+    self._closed = True
+    for (i, (p, conn)) in enumerate(self._workers):
+      try:
+        conn.send('stop')
+        if conn.poll(5):
+          self._states[i] = conn.recv()[2]
+      except (EOFError, IOError, OSError):
+        pass
+      p.join(5)
+      if p.is_alive():
+        p.terminate()
+      conn.close()
+
+  def _self_report_if_due(self):
+    """Return the shards' health reports and the merged timing report if the self-report interval has passed."""
+    if datetime.now() <= self._next_self_report:
+      return []
+    r = []
+    timings = {}
+    for result in self._request('report'):
+      if result is None:
+        continue
+      (health, shard_timings) = result
+      r.extend(health)
+      for (key, h) in shard_timings.iteritems():
+        timings.setdefault(key, LatencyHistogram()).merge(h)
+    r.extend(_pool_timing_readings(timings))
+    restarts = SensorReading(datetime.now(), "all-")
+    restarts.set("shard_restarts", self._restarts)
+    r.append(restarts)
+    self._next_self_report = datetime.now() + timedelta(0, config['self_report_interval'])
+    return r
+
+class BatchEvaluator:
+  """Decides which of many fresh readings are attention-worthy in one vectorized pass.
+
+  Public methods:
+  evaluate(updates)
+  refresh(sensor)
+
+  Applies the same rules as SensorModuleChecker (needs_check() or 
+  exceeds_threshold(), then update() and get_data_update()), but keeps each 
+  sensor's threshold, interval, next check time and current value in 
+  contiguous NumPy arrays so that the decision for a whole sweep is a 
+  handful of array operations.  Only the sensors which pass are then 
+  updated one at a time.  Without NumPy, falls back to evaluating each 
+  sensor in turn.
+  """
+
+  _sensors = None
+  _index = None
+  """Dict mapping each SensorChecker to its position in the arrays."""
+
+  _threshold = None
+  _interval = None
+  """Poll intervals in seconds."""
+
+  _next_check = None
+  """Next check times as epoch seconds."""
+
+  _current = None
+  """Current values (NaN if unavailable)."""
+
+  _has_current = None
+  _current_available = None
+
+  _observing = False
+  """True if any sensor needs every reading passed to SensorChecker.observe()."""
+
+  def __init__(self, sensors):
+    """Build the arrays for a list of SensorCheckers."""
+    self._sensors = list(sensors)
+    self._index = dict([(s, i) for (i, s) in enumerate(self._sensors)])
+    self._observing = bool(config['history_capacity'] or [s for s in self._sensors if s.adaptive()])
+    if numpy is None:
+      return
+    n = len(self._sensors)
+    self._threshold = numpy.zeros(n)
+    self._interval = numpy.zeros(n)
+    self._next_check = numpy.zeros(n)
+    self._current = numpy.zeros(n)
+    self._has_current = numpy.zeros(n, dtype=bool)
+    self._current_available = numpy.zeros(n, dtype=bool)
+    for s in self._sensors:
+      self.refresh(s)
+
+  def refresh(self, sensor):
+    """Reload a sensor's entries from its SensorChecker (after its state is changed elsewhere)."""
+    if numpy is None:
+      return
+    i = self._index[sensor]
+    self._threshold[i] = sensor.alert_threshold()
+    self._interval[i] = _total_seconds(sensor.poll_interval())
+    self._next_check[i] = _epoch(sensor.next_check_time())
+    current = sensor.current_reading()
+    self._has_current[i] = current is not None
+    self._current_available[i] = current is not None and current.available()
+    if self._current_available[i]:
+      self._current[i] = current.value()
+    else:
+      self._current[i] = numpy.nan
+
+  def evaluate(self, updates, now=None):
+    """Apply fresh readings, return list of alerting SensorReadings.
+
+    Arguments:
+    updates -- list of (SensorChecker, SensorReading) pairs
+    now -- datetime to evaluate schedules against (default now)
+    """
+    if self._observing:
+      for (s, r) in updates:
+        s.observe(r)
+
+    if numpy is None:
+      selected = [(s, r) for (s, r) in updates if s.needs_check(now) or s.exceeds_threshold(r)]
+    else:
+      selected = [updates[k] for k in self._select(updates, now)]
+
+    new_alerts = []
+    for (s, r) in selected:
+      s.update(r)
+      self.refresh(s)
+      sr = s.get_data_update()
+      if (sr):
+        new_alerts.append(sr)
+    return new_alerts
+
+  def _select(self, updates, now):
+    """Return the positions in updates which need attention."""
+    if not updates:
+      return []
+    if now is None:
+      now = datetime.now()
+    idx = numpy.fromiter((self._index[s] for (s, r) in updates), dtype=numpy.intp, count=len(updates))
+    new_available = numpy.fromiter((r.available() for (s, r) in updates), dtype=bool, count=len(updates))
+    new = numpy.fromiter((r.value() if r.available() else numpy.nan for (s, r) in updates),
+                         dtype=float, count=len(updates))
+
+    needs = (self._interval[idx] == 0) | (_epoch(now) > self._next_check[idx])
+
+    threshold = self._threshold[idx]
+    current = self._current[idx]
+    variance = current * threshold
+    with numpy.errstate(invalid='ignore'):      ## NaNs compare False, as intended
+      varies = (new > current + variance) | (new < current - variance)
+    exceeds = ((threshold != 0)
+               & (~self._has_current[idx]                                     # first pass
+                  | (new_available & (~self._current_available[idx] | varies))))
+
+    return numpy.flatnonzero(needs | exceeds)
+
+class _PipelineSweep:
+  """The modules of one PipelinedPoller.check_modules() call still in the pipeline, and their alerts."""
+
+  def __init__(self, count):
+    self.remaining = count
+    self.alerts = []
+    self.error = None
+    self.cond = threading.Condition()
+
+  def done(self, alerts, error=None):
+    """Record that a module has left the pipeline."""
+    self.cond.acquire()
+    try:
+      self.alerts.extend(alerts)
+      if error is not None and self.error is None:
+        self.error = error
+      self.remaining -= 1
+      if self.remaining == 0:
+        self.cond.notify_all()
+    finally:
+      self.cond.release()
+
+  def wait(self):
+    self.cond.acquire()
+    try:
+      while self.remaining > 0:
+        self.cond.wait(1)                 ## a timeout keeps the wait interruptible by signals
+    finally:
+      self.cond.release()
+
+class PipelinedPoller:
+  """Polls modules through separate fetch, parse and evaluate stages connected by bounded queues.
+
+  Public methods:
+  check_modules(modules)
+  stats()
+  report()
+  close()
+
+  SensorModuleChecker.check() fetches, parses and evaluates in one call, so 
+  a worker stuck on the network holds up parsing and vice versa.  Here fetch
+  workers only wait on appliances (see SensorModuleChecker.fetch()), parse 
+  workers only parse (parse()), and a single evaluator thread updates the 
+  SensorCheckers (evaluate()), so sensor state is never touched from two 
+  threads.  Each stage hands modules to the next through a bounded Queue: if 
+  parsing falls behind, fetch workers block on the full parse queue rather 
+  than piling up pages, and stats() shows where the backlog is.  Parse 
+  workers share the GIL, so beyond a couple of them more only help while 
+  pages are being fetched; ShardedCheckerPool spreads parsing over CPUs.
+
+  CheckerPool uses one when config['pipeline'] is set.
+  """
+
+  _STAGES = ('fetch', 'parse', 'evaluate')
+
+  _queues = None
+  """Dict of each stage's input Queue."""
+
+  _workers = None
+  """Dict of each stage's number of worker threads."""
+
+  _threads = None
+  _max_per_host = None
+  _limits = None
+  """Dict of BoundedSemaphores keyed by host, limiting the fetches from each host at once."""
+
+  _lock = None
+  _busy = None
+  """Dict of each stage's number of workers busy right now."""
+
+  _busy_time = None
+  """Dict of each stage's seconds of work since the last report()."""
+
+  _peak_depth = None
+  """Dict of each stage's deepest queue since the last report()."""
+
+  _since = None
+  """time.time() of the last report()."""
+
+  def __init__(self, fetch_workers=None, parse_workers=None, queue_size=None, max_per_host=None):
+    """Start the stage threads.
+
+    Arguments:
+    fetch_workers -- modules fetched at once (default config['max_concurrency'])
+    parse_workers -- pages parsed at once (default config['pipeline_parse_workers'])
+    queue_size -- capacity of each stage's queue (default config['pipeline_queue_size'])
+    max_per_host -- modules on one host fetched at once (default config['max_per_host'])
+    """
+    if fetch_workers is None:
+      fetch_workers = config['max_concurrency']
+    if parse_workers is None:
+      parse_workers = config['pipeline_parse_workers']
+    if queue_size is None:
+      queue_size = config['pipeline_queue_size']
+    if max_per_host is None:
+      max_per_host = config['max_per_host']
+    self._workers = {'fetch': max(1, fetch_workers), 'parse': max(1, parse_workers), 'evaluate': 1}
+    self._max_per_host = max_per_host
+    self._limits = {}
+    self._lock = threading.Lock()
+    self._queues = {}
+    self._busy = {}
+    self._busy_time = {}
+    self._peak_depth = {}
+    for stage in self._STAGES:
+      self._queues[stage] = Queue.Queue(queue_size)
+      self._busy[stage] = 0
+      self._busy_time[stage] = 0.0
+      self._peak_depth[stage] = 0
+    self._since = time.time()
+    self._threads = []
+    for stage in self._STAGES:
+      func = getattr(self, "_" + stage)
+      for i in range(self._workers[stage]):
+        t = threading.Thread(target=self._run, args=(stage, func))
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+  def check_modules(self, modules):
+    """Fetch, parse and evaluate the given SensorModuleCheckers, return list of alerting SensorReadings.
+
+    If any stage raised, the first exception is re-raised once every module 
+    has left the pipeline.
+    """
+    if not modules:
+      return []
+    sweep = _PipelineSweep(len(modules))
+    for smc in modules:
+      self._put('fetch', (sweep, smc))
+    sweep.wait()
+    if sweep.error is not None:
+      raise sweep.error
+    return sweep.alerts
+
+  def _put(self, stage, item):
+    q = self._queues[stage]
+    q.put(item)
+    depth = q.qsize()
+    if depth > self._peak_depth[stage]:
+      self._peak_depth[stage] = depth
+
+  def _run(self, stage, func):
+    """Work loop of one of a stage's threads."""
+    q = self._queues[stage]
+    while True:
+      item = q.get()
+      if item is None:
+        return
+      self._lock.acquire()
+      self._busy[stage] += 1
+      self._lock.release()
+      start = time.time()
+      try:
+        func(item)
+      except Exception, e:
+        item[0].done([], e)               ## the module leaves the pipeline here
+      self._lock.acquire()
+      self._busy[stage] -= 1
+      self._busy_time[stage] += time.time() - start
+      self._lock.release()
+
+  def _fetch(self, item):
+    (sweep, smc) = item
+    limit = None
+    if self._max_per_host:
+      self._lock.acquire()
+      limit = self._limits.setdefault(smc.host(), threading.BoundedSemaphore(self._max_per_host))
+      self._lock.release()
+      limit.acquire()
+    try:
+      fetched = smc.fetch()
+    finally:
+      if limit:
+        limit.release()
+    if fetched:
+      self._put('parse', item)
+    else:
+      self._put('evaluate', (sweep, smc, None))
+
+  def _parse(self, item):
+    (sweep, smc) = item
+    self._put('evaluate', (sweep, smc, smc.parse()))
+
+  def _evaluate(self, item):
+    (sweep, smc, sensorReadings) = item
+    if sensorReadings is None:
+      sweep.done([])
+    else:
+      sweep.done(smc.evaluate(sensorReadings))
+
+  def stats(self):
+    """Return a dict keyed by stage of dicts with the stage's workers, busy workers, queue_depth, 
+    peak_depth and occupancy (the fraction of its workers' time spent working) since the last report()."""
+    elapsed = max(time.time() - self._since, 1e-6)
+    r = {}
+    self._lock.acquire()
+    try:
+      for stage in self._STAGES:
+        r[stage] = {'workers': self._workers[stage],
+                    'busy': self._busy[stage],
+                    'queue_depth': self._queues[stage].qsize(),
+                    'peak_depth': self._peak_depth[stage],
+                    'occupancy': self._busy_time[stage] / (elapsed * self._workers[stage])}
+    finally:
+      self._lock.release()
+    return r
+
+  def report(self):
+    """Return SensorReadings pipeline-<stage>_queue_peak and pipeline-<stage>_occupancy (see stats()).
+
+    Side effects: resets the peak depths and occupancy.
+    """
+    r = []
+    stats = self.stats()
+    for stage in self._STAGES:
+      for (key, value) in (("queue_peak", stats[stage]['peak_depth']),
+                           ("occupancy", stats[stage]['occupancy'])):
+        reading = SensorReading(datetime.now(), "pipeline-")
+        reading.set("%s_%s" % (stage, key), value)
+        r.append(reading)
+    self._lock.acquire()
+    try:
+      for stage in self._STAGES:
+        self._busy_time[stage] = 0.0
+        self._peak_depth[stage] = 0
+      self._since = time.time()
+    finally:
+      self._lock.release()
+    return r
+
+  def close(self):
+    """Stop the stage threads once the work already queued is done."""
+    for stage in self._STAGES:
+      for i in range(self._workers[stage]):
+        self._queues[stage].put(None)
+
+class SensorModuleChecker:
+  """A single "Sensor Module", which is a unit of Netbotz hardware for which 
+  we get results.  
+  
+  Public methods:
+  check()
+  db_id()
+  evaluate()
+  fetch()
+  identity()
+  parse()
+  poll()
+  reconfigure()
+  replay_page()
+  restore_checkpoint()
+  self_report_if_due()
+  host()
+  sensors()
+  url()
+  next_due()
+  last_timings()
+  last_fetch_failed()
+  avg_poll_time()
+  num_failures()
+  num_successes()
+  
+  Public attributes:
+  self_report_interval_len
+  
+  Note: A module may contain multiple different sensors, 
+  but since we bear the majority of the retrieval cost in getting the HTML, 
+  we group them together for performance reasons.
+
+  Values change slowly, so most polls return a page identical to the last 
+  one.  The readings parsed from the last page are cached along with a digest 
+  of its contents (and its ETag/Last-Modified headers, if the appliance sends 
+  them); when the page hasn't changed, the cached readings are re-stamped with
+  the new retrieval time instead of parsing the page again.
+  """
+  
+  ## FIXMEs:
+  ##
+  ## * At most, db_id should be an optional argument (to save a db query) -- 
+  ##   there's no reason we can't query for the id from here.
+  
+  self_report_interval = None
+  """A timedelta object describing the interval (in seconds) between reports 
+  on the speed and success rate of the sensor check.  
+  Failure/success counters and average time are reset after each report."""
+  
+  _sensors = None
+  _url = None
+  _html = None 
+  _html_ts = None
+  _html_digest = None
+  _html_validators = None
+  _dbh = None  
+  _host = None
+  _module_name = None
+  _display_name = None
+  _display_prefix = None
+  _db_id = None
+  _avg_poll_time = None
+  _poll_failure_count = None
+  _poll_success_count = None
+  _next_self_report = None
+
+  _cache_digest = None
+  """Digest of the page the cached readings were parsed from."""
+
+  _cache_validators = None
+  """Dict of conditional request headers for the cached page."""
+
+  _cached_readings = None
+  """Dict of NBSensorReadings keyed by sensor name, parsed from the cached page."""
+
+  _cache_hit_count = None
+  _cache_miss_count = None
+
+  _last_attempt = None
+  """Time of the last retrieval attempt."""
+
+  _last_attempt_failed = False
+
+  _breaker = None
+  """Shared CircuitBreaker for the module's host."""
+
+  _poll_refused_count = None
+  """Polls skipped because the host's CircuitBreaker was open."""
+
+  _timings = None
+  """Dict of LatencyHistograms keyed by phase (see _TIMING_PHASES) for this self-report interval."""
+
+  _last_timings = None
+  """Dict of seconds spent in each phase by the last check()."""
+
+  _index = None
+  """LatestValueIndex to record every parsed reading in, if any."""
+
+  def __init__(self, host, module_name, display_name, db_id, dbh, sensors=None, index=None):
+    """Initialize the SensorModule, including instantiating associated SensorCheckers.
+    
+    Arguments:
+    host -- hostname or IP of the netbotz hardware
+    module_name -- (string) netbotz name for the module
+    display_name -- name used for display (may be more intelligible than netbotz' name)
+    db_id -- id # of this module in the config database
+    dbh -- connected database handle to the db containing the sensor config
+    sensors -- optional list of sensor config dicts (as from load_pool_config()); 
+               if given, the sensor config is not queried from the db
+    index -- optional LatestValueIndex to record each poll's readings in
+    """
+    self._sensors = []
+    self._index = index
+    self._host = host
+    self._module_name = module_name
+    self._display_name = display_name or module_name
+    self._display_prefix = _intern(self._display_name + "-")
+    self._db_id = db_id
+    self._dbh = dbh
+    self._breaker = get_circuit_breaker(host)
+    self.self_report_interval = timedelta(0,config['self_report_interval'])
+    
+    self._url = self._host + "/pages/status.html?encid=" + self._module_name
+    #print "DEBUG: instantiating SMC for %s (%s, %d)" % (self._module_name, self._display_name, self._db_id)
+    #print "           url = %s" % self._url
+    self._init_sensors(sensors)
+    self._init_selfrpt_interval()
+    #print "DEBUG: %d sensors found" % len(self._sensors)
+
+  def _init_sensors(self, sensors=None):
+    """Create sensor objects for all defined & enabled sensors."""
+    #print "DEBUG: _init_sensors() for %s" % self._display_name
+    if sensors is not None:
+      for sensor in sensors:
+        self._sensors.append(SensorChecker(sensor['name'], sensor['id'], self._dbh, sensor))
+      return
+
+    c = self._dbh.cursor()
+    c.execute("""SELECT id, sensor_name FROM sensor WHERE module = %s AND track_data = TRUE""", (self._db_id))
+    sensors = c.fetchall()
+    c.close()
+    #print "DEBUG: %d sensors for %s" % (len(sensors), self._display_name)
+    for (sensor_id, sensor_name) in sensors:
+      s = SensorChecker(sensor_name, sensor_id, self._dbh)
+      self._sensors.append(s)
+
+  def _init_selfrpt_interval(self):
+    """Reset counters and interval timer for self-reporting."""
+    self._avg_poll_time = None
+    self._timings = {}
+    for phase in _TIMING_PHASES:
+      self._timings[phase] = LatencyHistogram()
+    self._poll_failure_count = 0
+    self._poll_success_count = 0
+    self._poll_refused_count = 0
+    self._cache_hit_count = 0
+    self._cache_miss_count = 0
+    self._next_self_report = datetime.now() + self.self_report_interval
+    
+  def _record_poll_run(self,start,end):
+    """Updates the running average poll time and success counter.  Takes start and end of a polling run."""
+    self._poll_success_count += 1
+    if self._avg_poll_time is None:
+      self._avg_poll_time = end - start
+    else:
+      self._avg_poll_time += ((end - start) - self._avg_poll_time) / self._poll_success_count
+      
+    # print "DEBUG: average %s seconds to poll (%d/%d successful)" % (self._avg_poll_time, self._poll_success_count, 
+    #                                                               self._poll_success_count + self._poll_failure_count)
+
+  def _retrieve_HTML(self):
+    """Retrieve the HTML containing this module's update.
+    
+    Side effects:
+    - on success, increment success counter and add timing data to current running average
+    - on failure (of any sort), increment failure counter
+    - either way, tell the host's CircuitBreaker; if the breaker is open, 
+      nothing is retrieved and the refused counter is incremented instead.  
+      Only network failures count against the host: an HTTP error status 
+      fails this module but shows the host itself is up.
+    """
+    self._html = None
+    self._html_digest = None
+    self._last_timings = {}
+    
+    start_time = datetime.now()
+    self._last_attempt = start_time
+    self._last_attempt_failed = True
+    if not self._breaker.allow_request():
+      print "Host %s is down, not retrying until %s." % (self._host, self._breaker.retry_at())
+      self._poll_refused_count += 1
+      return
+
+    try:
+      (status, headers, self._html) = _http_request(self._url, Deadline(), self._cache_validators,
+                                                    self._last_timings)
+      if status == 304:                     ## not modified since the cached page
+        self._html_digest = self._cache_digest
+      elif status != 200:
+        ## the host answered, so only this module has failed
+        _log.warning("HTTP %d retrieving %s", status, self._url)
+        self._poll_failure_count += 1
+        self._breaker.record_success()
+        self._html = None
+        return
+      else:
+        self._html_digest = hashlib.sha1(self._html).digest()
+        self._html_validators = {}
+        if headers.getheader("etag"):
+          self._html_validators["If-None-Match"] = headers.getheader("etag")
+        if headers.getheader("last-modified"):
+          self._html_validators["If-Modified-Since"] = headers.getheader("last-modified")
+    except DeadlineExceeded:
+      print "Read timeout."
+      self._poll_failure_count += 1
+      self._breaker.record_failure()
+      self._html = None
+      return
+    except (IOError, httplib.HTTPException), e:
+      print "Networking error: %s" % e
+      self._poll_failure_count += 1
+      self._breaker.record_failure()
+      self._html = None
+      return
+    
+    self._breaker.record_success()
+    self._html_ts = datetime.now()
+    self._last_attempt_failed = False
+    if config['archive']:
+      get_archive_writer(config['archive']).append(self._url, self._html_ts,
+                                                   self._html if status == 200 else None, self._html_digest)
+    self._record_poll_run(start_time, self._html_ts)
+    self._timings['connect'].record(self._last_timings['connect'])
+    self._timings['download'].record(self._last_timings['download'])
+  
+  def _self_report(self):
+    """Return SensorReadings for failure rates and average HTML poll time.
+    
+    Side effects: starts new self-report interval and resets counters
+    """
+    r = []
+    
+    total = (self._poll_success_count + self._poll_failure_count)
+    if total > 0:
+      failure_rate = SensorReading(datetime.now(), self._display_prefix)
+      failure_rate.set("poll_failure_rate", float(self._poll_failure_count) / total)
+      r.append(failure_rate)
+
+    adaptive = [s.watch_interval() for s in self._sensors if s.adaptive()]
+    if adaptive:
+      watch = SensorReading(datetime.now(), self._display_prefix)
+      watch.set("watch_interval", min(adaptive))
+      r.append(watch)
+
+    if self._poll_refused_count > 0:
+      refused = SensorReading(datetime.now(), self._display_prefix)
+      refused.set("polls_refused", self._poll_refused_count)
+      r.append(refused)
+
+    if self._poll_success_count > 0:
+      avg_poll = SensorReading(datetime.now(), self._display_prefix)
+      avg_poll.set("avg_html_retrieval", self.avg_poll_time())
+      r.append(avg_poll)
+
+    if (self._cache_hit_count + self._cache_miss_count) > 0:
+      hits = SensorReading(datetime.now(), self._display_prefix)
+      hits.set("parse_cache_hits", self._cache_hit_count)
+      r.append(hits)
+      misses = SensorReading(datetime.now(), self._display_prefix)
+      misses.set("parse_cache_misses", self._cache_miss_count)
+      r.append(misses)
+
+    r.extend(_timing_readings(self._timings, self._display_prefix))
+
+    self._init_selfrpt_interval()
+    return r
+    
+  def _parse_HTML(self):
+    """Return a dict of NBSensorReadings keyed by sensor name from the last retrieved HTML.
+
+    Returns None if the page could not be parsed.
+    """
+    if self._cached_readings is not None and self._html_digest == self._cache_digest:
+      ## same page as last time; reuse the readings with the new timestamp
+      self._cache_hit_count += 1
+      sensorReadings = {}
+      for (key, cached) in self._cached_readings.iteritems():
+        sensorReadings[key] = cached.stamped(self._html_ts)
+      return sensorReadings
+    self._cache_miss_count += 1
+
+    ## There may be sensor readings we don't care about parsed from the HTML, but we need to parse them all
+    ##   to see what they are.
+    try:
+      readings = parse_status_page(self._html, self._html_ts, self._display_prefix)
+    except ValueError, e:
+      print "Unparseable HTML (%s), skipping check." % e
+      return None
+
+    sensorReadings = {}
+    for r in readings:
+      sensorReadings[r.key()] = r
+    self._cache_digest = self._html_digest
+    self._cache_validators = self._html_validators
+    self._cached_readings = sensorReadings
+    return sensorReadings
+
+  def _evaluate(self, sensorReadings, now=None):
+    """Update sensors from a dict of fresh readings, return list of alerting SensorReadings.
+
+    Arguments:
+    sensorReadings -- dict of NBSensorReadings keyed by sensor name
+    now -- datetime to judge the sensors' schedules against (default now)
+    """
+    new_alerts = []
+    for s in self._sensors:
+      if not s.name() in sensorReadings:   ## need this in case the NBSensorReading instantiation failed
+        continue
+      if (sensorReadings[s.name()]):            ## if we just got an update for this sensor
+        s.observe(sensorReadings[s.name()])
+        if s.needs_check(now) or s.exceeds_threshold(sensorReadings[s.name()]):  ## ... and it's attention-worthy
+          s.update(sensorReadings[s.name()])
+          sr = s.get_data_update()
+          if (sr):                              ##  ... and it is different than the last value
+            new_alerts.append(sr)               ##  ... then alert on it.
+    return new_alerts
+
+  def poll(self):
+    """Retrieve and parse the module's page, return a dict of NBSensorReadings keyed by sensor name.
+
+    Returns None if the page could not be retrieved or parsed.  Sensors are 
+    not updated; see check().
+    """
+    if not self.fetch():
+      return None
+    return self.parse()
+
+  def fetch(self):
+    """Retrieve the module's page (the first step of poll()); return True if it was retrieved."""
+    self._retrieve_HTML()
+
+    if (self._html is None):
+      print "HTML is null, skipping check."
+      return False
+    return True
+
+  def parse(self):
+    """Parse the page just fetched (the second step of poll()), return a dict of NBSensorReadings 
+    keyed by sensor name, or None if it could not be parsed."""
+    start = time.time()
+    sensorReadings = self._parse_HTML()
+    self._last_timings['parse'] = time.time() - start
+    self._timings['parse'].record(self._last_timings['parse'])
+    if sensorReadings is not None and self._index is not None:
+      self._index.update(self._host, self._module_name, self._display_name, sensorReadings.itervalues())
+    return sensorReadings
+
+  def self_report_if_due(self):
+    """Return the self-report SensorReadings if the self-report interval has passed, else []."""
+    if datetime.now() > self._next_self_report:
+      return self._self_report()
+    return []
+
+  def sensors(self):
+    """Return the list of SensorCheckers for this module."""
+    return self._sensors
+
+  def url(self):
+    """Return the url of the module's status page."""
+    return self._url
+
+  def db_id(self):
+    """Return the module's id # in the config database."""
+    return self._db_id
+
+  def identity(self):
+    """Return (host, module name, display name), which a reconfigure() can't change."""
+    return (self._host, self._module_name, self._display_name)
+
+  def reconfigure(self, sensors):
+    """Bring the module's sensors in line with a new list of sensor config dicts.
+
+    Sensors no longer listed are dropped, new ones are added, and the rest 
+    keep their readings and schedule (see SensorChecker.retune()); a sensor 
+    whose name changed is replaced.  Returns True if anything changed.
+    """
+    current = dict([(s.db_id(), s) for s in self._sensors])
+    changed = len(sensors) != len(self._sensors)
+    new_sensors = []
+    for sensor in sensors:
+      s = current.get(sensor['id'])
+      if s is None or s.name() != sensor['name']:
+        s = SensorChecker(sensor['name'], sensor['id'], self._dbh, sensor)
+        changed = True
+      elif s.retune(sensor):
+        changed = True
+      new_sensors.append(s)
+    self._sensors = new_sensors
+    return changed
+
+  def restore_checkpoint(self, checkpoint):
+    """Restore the state of each of the module's sensors found in a Checkpoint."""
+    for s in self._sensors:
+      record = checkpoint.get(s.db_id())
+      if record is not None:
+        s.restore_checkpoint(record, self._display_prefix)
+
+  def replay_page(self, html, ts):
+    """Parse and evaluate a previously retrieved page as if it had just been polled at ts.
+
+    Returns list of alerting SensorReadings.  Nothing is fetched, and poll 
+    statistics are untouched.  See ArchiveReader.replay().
+    """
+    self._html = html
+    self._html_ts = ts
+    self._html_digest = hashlib.sha1(html).digest()
+    sensorReadings = self._parse_HTML()
+    if sensorReadings is None:
+      return []
+    return self._evaluate(sensorReadings, ts)
+
+  def check(self):
+    """Check all sensors, return list of alerting SensorReadings."""
+    sensorReadings = self.poll()
+    if sensorReadings is None:
+      return []
+    return self.evaluate(sensorReadings)
+
+  def evaluate(self, sensorReadings):
+    """Update the sensors from a dict of readings returned by poll() or parse(), return list of 
+    alerting SensorReadings (including the self-report, if due)."""
+    new_alerts = []
+    start = time.time()
+    new_alerts.extend(self._evaluate(sensorReadings))
+    self._last_timings['evaluate'] = time.time() - start
+    self._timings['evaluate'].record(self._last_timings['evaluate'])
+
+    new_alerts.extend(self.self_report_if_due())
+
+    return new_alerts
+
+  def avg_poll_time(self):
+    """Returns float from underlying timedelta."""
+    try:
+      return self._avg_poll_time.total_seconds()
+    except AttributeError:  # total_seconds() is new in python 2.7
+      return _total_seconds(self._avg_poll_time)
+      
+    
+  def host(self):
+    """Return the netbotz host this module is attached to."""
+    return self._host
+
+  def last_timings(self):
+    """Return a dict of seconds spent in each phase (connect, download, parse, evaluate) by the last check().
+
+    Phases that weren't reached (e.g. after a network error) are absent.
+    """
+    return self._last_timings or {}
+
+  def last_fetch_failed(self):
+    """Return True if the last attempt to fetch this module's page failed or was refused."""
+    return self._last_attempt_failed
+
+  def next_due(self):
+    """Return the datetime at which this module next needs to be fetched (None if never).
+
+    A module is due when any of its sensors is due for a scheduled update.  If 
+    any sensor alerts on threshold variance (or updates on every change), the 
+    module is also fetched every SensorChecker.watch_interval() seconds (the 
+    shortest of them) so that those changes are noticed.  A sensor with a 
+    poll_interval of 0 is scheduled only that way, and no sensor is due 
+    sooner than its poll interval after the last retrieval, so a sensor that 
+    didn't appear on the page can't keep the module due.  After a failed retrieval the module isn't 
+    retried for config['retry_interval'] seconds, nor while its host's 
+    CircuitBreaker is refusing requests.
+    """
+    if not self._sensors:
+      return None
+    due = None
+    for s in self._sensors:
+      if not s.poll_interval():            ## updated on every change; see the watch interval below
+        continue
+      t = s.next_check_time()
+      if self._last_attempt is not None:
+        t = max(t, self._last_attempt + s.poll_interval())
+      if due is None or t < due:
+        due = t
+    if self._last_attempt is None:
+      if due is None:
+        due = datetime.now()
+    else:
+      watch = [s.watch_interval() for s in self._sensors if s.alert_threshold() != 0 or not s.poll_interval()]
+      if watch:
+        watch_due = self._last_attempt + timedelta(0, min(watch))
+        if due is None or watch_due < due:
+          due = watch_due
+      if self._last_attempt_failed:
+        due = max(due, self._last_attempt + timedelta(0, config['retry_interval']))
+    retry_at = self._breaker.retry_at()
+    if retry_at is not None:
+      due = max(due, retry_at)
+    return due
+
+  def num_failures(self):
+    return self._poll_failure_count
+    
+  def num_successes(self):
+    return self._poll_success_count
+
+class SensorHistory:
+  """Fixed-capacity history of the numeric readings of a single sensor.
+
+  Public methods:
+  append(ts, value)
+  last(n)
+  between(start, end)
+  summary(start, end)
+  downsample(width, start, end)
+
+  Timestamps (as epoch seconds) and values are kept in a pair of ring 
+  buffers of doubles, so memory use is fixed at 16 bytes per sample.  When 
+  full, the oldest sample is overwritten.  Samples are assumed to arrive in 
+  time order.  Queries take and return datetimes.
+  """
+
+  _ts = None
+  _values = None
+  _capacity = None
+  _start = 0
+  """Buffer index of the oldest sample."""
+
+  _count = 0
+
+  def __init__(self, capacity):
+    """Create an empty history holding up to capacity samples."""
+    self._capacity = capacity
+    self._ts = array.array('d', [0.0]) * capacity
+    self._values = array.array('d', [0.0]) * capacity
+
+  def __len__(self):
+    return self._count
+
+  def append(self, ts, value):
+    """Add a sample.
+
+    Arguments:
+    ts -- datetime of the reading
+    value -- numeric value of the reading
+    """
+    if self._count < self._capacity:
+      i = (self._start + self._count) % self._capacity
+      self._count += 1
+    else:
+      i = self._start
+      self._start = (self._start + 1) % self._capacity
+    self._ts[i] = _epoch(ts)
+    self._values[i] = value
+
+  def last(self, n):
+    """Return the most recent n samples as a list of (datetime, value), oldest first."""
+    n = min(n, self._count)
+    return self._samples(self._count - n, self._count)
+
+  def between(self, start=None, end=None):
+    """Return samples with start <= timestamp <= end as a list of (datetime, value).
+
+    Either bound may be None to leave that end of the range open.
+    """
+    (lo, hi) = self._range(start, end)
+    return self._samples(lo, hi)
+
+  def summary(self, start=None, end=None):
+    """Return (min, max, mean) of the values between start and end, or None if there are none."""
+    (lo, hi) = self._range(start, end)
+    if lo >= hi:
+      return None
+    values = [self._values[(self._start + i) % self._capacity] for i in xrange(lo, hi)]
+    return (min(values), max(values), sum(values) / len(values))
+
+  def downsample(self, width, start=None, end=None):
+    """Return per-window statistics for the samples between start and end.
+
+    Arguments:
+    width -- window length in seconds
+    start, end -- optional datetime bounds
+
+    Returns a list of (window start datetime, min, max, mean), oldest first, 
+    with windows aligned to multiples of width since the epoch.  Windows 
+    without samples are omitted.
+    """
+    (lo, hi) = self._range(start, end)
+    r = []
+    window = None
+    for i in xrange(lo, hi):
+      j = (self._start + i) % self._capacity
+      (ts, v) = (self._ts[j], self._values[j])
+      w = ts - (ts % width)
+      if w != window:
+        if window is not None:
+          r.append((datetime.fromtimestamp(window), lo_v, hi_v, total / n))
+        (window, lo_v, hi_v, total, n) = (w, v, v, 0.0, 0)
+      lo_v = min(lo_v, v)
+      hi_v = max(hi_v, v)
+      total += v
+      n += 1
+    if window is not None:
+      r.append((datetime.fromtimestamp(window), lo_v, hi_v, total / n))
+    return r
+
+  def _samples(self, lo, hi):
+    """Return samples lo..hi-1 (counted from the oldest) as (datetime, value) tuples."""
+    r = []
+    for i in xrange(lo, hi):
+      j = (self._start + i) % self._capacity
+      r.append((datetime.fromtimestamp(self._ts[j]), self._values[j]))
+    return r
+
+  def _range(self, start, end):
+    """Return the (lo, hi) sample positions covering start <= timestamp <= end."""
+    lo = 0
+    hi = self._count
+    if start is not None:
+      lo = self._bisect(_epoch(start), False)
+    if end is not None:
+      hi = self._bisect(_epoch(end), True)
+    return (lo, max(lo, hi))
+
+  def _bisect(self, t, right):
+    """Return the position of the first sample later than t (right) or not earlier than t."""
+    (lo, hi) = (0, self._count)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      ts = self._ts[(self._start + mid) % self._capacity]
+      if ts < t or (right and ts == t):
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+def _epoch(dt):
+  """Return a datetime as float seconds since the epoch (local time)."""
+  return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+class SensorChecker:
+  """A single netbotz sensor.
+  
+  Public methods:
+  adaptive()
+  alert_threshold()
+  current_reading()
+  db_id()
+  exceeds_threshold()
+  export_state()
+  get_data_udpate()
+  history()
+  name()
+  needs_check()
+  next_check_time()
+  observe()
+  poll_interval()
+  reschedule()
+  restore_checkpoint()
+  restore_state()
+  retune()
+  update()
+  watch_interval()
+
+  A sensor with an alert threshold (or a poll interval of 0) is also watched 
+  between its scheduled updates, by fetching its module every 
+  watch_interval() seconds.  Normally that is config['threshold_poll_interval'],
+  but with adaptive_interval set in the db the watch interval follows the 
+  sensor's behaviour: each fresh reading which hardly moves (by less than 
+  config['adaptive_flat'] of the alert threshold) widens it by 
+  config['adaptive_step'], each larger movement narrows it by the same 
+  factor, and a movement which crosses the alert threshold drops it straight 
+  to the floor, all within config['adaptive_min_interval'] and 
+  config['adaptive_max_interval'].
+  """
+  
+  ## FIXMEs:
+  ##
+  ## * At most, db_id should be an optional argument (to save a db query) -- 
+  ##   there's no reason we can't query for the id from here.
+  
+  ## Private attributes
+  _sensor_name = None
+  """The string by which netbotz knows the sensor."""""
+
+  _module_name = None
+  """The display name of the parent sensor module."""
+
+  _db_id = None
+  _dbh = None
+
+  _next_check_time = None
+
+  _poll_interval = None
+  """Specified in seconds, stored as timedelta."""
+
+  _alert_threshold = None
+  """Sensor values which change by more than this percentage alert regardless of time."""
+  
+  _current_reading = None
+  """A SensorReading object."""
+
+  _previous_reading = None
+  """A SensorReading object."""
+
+  _history = None
+  """A SensorHistory of every numeric reading observed (None unless config['history_capacity'] is set)."""
+
+  _adaptive = False
+  """True if the watch interval adapts to the sensor's volatility."""
+
+  _watch_interval = None
+  """Current adaptive watch interval, in seconds."""
+
+  _last_observed = None
+  """The last SensorReading passed to observe()."""
+
+  _settings = None
+  """(poll_interval, alert_threshold, adaptive_interval) as given by the db, for retune()."""
+  
+  def __init__(self, sensor_name, db_id, dbh, sensor_config=None):
+    """Initialize the sensor, setting up schedule & threshold based on config in the db.
+    
+    Arguments:
+    sensor_name -- (string)
+    db_id -- id # of this module in the config database
+    dbh -- connected database handle to the db containing the sensor config
+    sensor_config -- optional dict with the sensor's poll_interval, alert_threshold and 
+                     adaptive_interval (as from load_pool_config()); if given, the db 
+                     is not queried
+    """
+    self._sensor_name = sensor_name
+    self._db_id = db_id
+    self._dbh = dbh
+    self._next_check_time = datetime.now()  ## set to check initially
+    if config['history_capacity']:
+      self._history = SensorHistory(config['history_capacity'])
+
+    if sensor_config is not None:
+      (interval, threshold, adaptive) = (sensor_config['poll_interval'], sensor_config['alert_threshold'],
+                                         sensor_config['adaptive_interval'])
+    else:
+      adaptive = _adaptive_interval_sql(self._dbh)
+      c = self._dbh.cursor()
+      c.execute("""SELECT poll_interval, alert_threshold, %s FROM sensor WHERE id = %%s AND track_data = TRUE""" % adaptive, (self._db_id))
+      assert(c.rowcount == 1)
+      (interval, threshold, adaptive) = c.fetchone()
+      c.close()
+    self._configure(interval, threshold, adaptive)
+
+  def _configure(self, interval, threshold, adaptive):
+    """Set the poll interval, alert threshold and adaptive flag from their db values."""
+    self._settings = (interval, threshold, bool(adaptive))
+    if (interval is not None):
+      self._poll_interval = timedelta(0,interval)
+    else:
+      self._poll_interval = timedelta(0,config['default_interval'])
+
+    if (threshold is not None):
+      self._alert_threshold = float(threshold)  ## DECIMAL columns arrive as Decimal, which won't mix with floats
+    else:
+      self._alert_threshold = config['default_threshold']
+
+    if adaptive and not self._adaptive:
+      self._watch_interval = float(config['threshold_poll_interval'])
+    self._adaptive = bool(adaptive)
+
+  def retune(self, sensor_config):
+    """Apply new settings (a dict as for __init__()) without losing readings or schedule.
+
+    The next scheduled update moves to the last one plus the new poll 
+    interval.  Returns True if anything changed.
+    """
+    settings = (sensor_config['poll_interval'], sensor_config['alert_threshold'],
+                bool(sensor_config['adaptive_interval']))
+    if settings == self._settings:
+      return False
+    old_interval = self._poll_interval
+    self._configure(*settings)
+    self._next_check_time += self._poll_interval - old_interval
+    return True
+
+  def name(self):
+    """Return sensor name."""
+    return self._sensor_name
+
+  def db_id(self):
+    """Return the sensor's id # in the config database."""
+    return self._db_id
+
+  def reschedule(self, when):
+    """Make the sensor next due for an update at the given datetime."""
+    self._next_check_time = when
+
+  def export_state(self):
+    """Return the sensor's schedule and reading state as a picklable tuple (see restore_state())."""
+    return (self._next_check_time, self._current_reading, self._previous_reading,
+            self._watch_interval, self._last_observed)
+
+  def restore_state(self, state):
+    """Resume from a state returned by export_state() (e.g. by another process)."""
+    (self._next_check_time, self._current_reading, self._previous_reading,
+     watch_interval, self._last_observed) = state
+    if self._adaptive and watch_interval is not None:
+      self._watch_interval = watch_interval
+
+  def restore_checkpoint(self, record, display_prefix=None):
+    """Resume from a record returned by Checkpoint.get().
+
+    Arguments:
+    record -- (next check time, value, reading time, watch interval)
+    display_prefix -- display prefix of the sensor's module, for the restored reading
+    """
+    self.restore_state(_checkpoint_state(record, self._sensor_name, display_prefix))
+
+  def next_check_time(self):
+    """Return the datetime at which this sensor is next due for an update."""
+    return self._next_check_time
+
+  def poll_interval(self):
+    """Return the poll interval as a timedelta."""
+    return self._poll_interval
+
+  def alert_threshold(self):
+    """Return the alert threshold (as a fraction of the last value; 0 disables)."""
+    return self._alert_threshold
+
+  def current_reading(self):
+    """Return the SensorReading most recently accepted by update() (None before the first)."""
+    return self._current_reading
+
+  def history(self):
+    """Return the SensorHistory for this sensor, or None if history isn't kept."""
+    return self._history
+
+  def watch_interval(self):
+    """Return the seconds between fetches to watch this sensor for threshold alerts."""
+    if self._adaptive:
+      return self._watch_interval
+    return config['threshold_poll_interval']
+
+  def adaptive(self):
+    """Return True if the watch interval adapts to the sensor's volatility."""
+    return self._adaptive
+
+  def observe(self, reading):
+    """Note a fresh SensorReading (whether or not it alerts).
+
+    The reading is recorded in the sensor's history, and the watch interval of 
+    an adaptive sensor is widened or narrowed based on how far it moved from 
+    the last one observed.
+    """
+    if self._history is not None and reading.available():
+      self._history.append(reading.ts, reading.value())
+    if self._adaptive:
+      if self._last_observed is not None:
+        self._adapt(self._last_observed, reading)
+      self._last_observed = reading
+
+  def _adapt(self, last, new):
+    """Adjust the watch interval for the movement from one observed reading to the next."""
+    if last.available() != new.available():
+      change = band = 1                   ## a sensor dropping out or coming back counts as a crossing
+    elif not new.available():
+      change = band = 0
+    else:
+      change = abs(new.value() - last.value())
+      band = abs(last.value()) * self._alert_threshold
+    if change > band:
+      watch = config['adaptive_min_interval']
+    elif change <= band * config['adaptive_flat']:
+      watch = min(self._watch_interval * config['adaptive_step'], config['adaptive_max_interval'])
+    else:
+      watch = max(self._watch_interval / config['adaptive_step'], config['adaptive_min_interval'])
+    self._watch_interval = float(watch)
+
+  def needs_check(self, now=None):
+    """Return True if this sensor is due for an update; otherwise False.
+
+    Arguments:
+    now -- datetime to compare the schedule against (default now)
+    """
+    if now is None:
+      now = datetime.now()
+    if (not self._poll_interval) or (now > self._next_check_time):
+      return True
+    return False
+
+  def exceeds_threshold(self, new_reading):
+    """Return True if new reading is +/- the last reading by > the alert threshold.  
+
+    Arguments:
+    new_reading -- a SensorReading object
+
+    Usage note: This should be called _before_ the update() method is called.  It would 
+    normally be used to determine if update() should be called.
+    """
+    if (self._alert_threshold == 0):
+      return False
+    if (self._current_reading is None):  # special case for first pass
+      return True
+    if not new_reading.available():      # special case for disconnected sensors yielding "N/A"
+      return False      
+    if not self._current_reading.available():  # ... and for them coming back
+      return True
+    current = self._current_reading.value()
+    new = new_reading.value()
+    variance = current * self._alert_threshold
+    if (new > current + variance) or (new < current - variance):
+      #print "DEBUG:  Alerting due to threshold variance!"
+      return True
+    return False
+  
+  def update(self, new_reading):
+    """Takes new SensorReading for this sensor, updates sensor based on its value. Returns nothing.
+
+    Side Effects: updates last_reading and _current_reading members, refreshes _next_check_time
+    """
+    self._previous_reading = self._current_reading
+    self._current_reading = new_reading
+
+    ### Important Note:  if we're polling more slowly than we're scheduled to, this time may be in the past.  That is by 
+    ###    design, though the alternatives (where next_check = now + _poll_interval or where 
+    ###   next_check = last_check_time + _poll_interval) are not insane.
+    self._next_check_time = self._next_check_time + self._poll_interval
+
+  def get_data_update(self):
+    """Returns a SensorReading if alert critera were satisfied."""
+
+    ## Only alert if the value has changed
+    if  (self._previous_reading is None         # first time through
+        or self._current_reading.value() != self._previous_reading.value()):
+      return self._current_reading
+
+####################################
+class ReadingSink:
+  """Base class for buffered, write-behind outputs for SensorReadings.
+
+  Public methods:
+  write(readings)
+  flush()
+  close()
+  stats()
+
+  write() only appends to a bounded in-memory buffer, so a slow destination 
+  never blocks polling.  A background thread sends the buffer in batches 
+  whenever config['sink_batch_size'] readings are waiting or the oldest has 
+  waited config['sink_max_age'] seconds.  When the buffer is full the oldest 
+  readings are dropped (and counted).  A batch that fails to send is retried 
+  until it succeeds or the sink is closed.  close() is registered to run at 
+  exit, so buffered readings are flushed on shutdown.
+
+  Subclasses implement _send(batch), which takes a list of SensorReadings and 
+  raises on failure.
+  """
+
+  _batch_size = None
+  _max_age = None
+  _buffer = None
+  """deque of (time queued, SensorReading)."""
+
+  _cond = None
+  _thread = None
+  _closing = False
+  _flush_requested = False
+  _in_flight = 0
+
+  _sent_count = 0
+  _dropped_count = 0
+  _failed_batches = 0
+  _max_depth = 0
+  _last_flush_latency = None
+
+  def __init__(self, batch_size=None, max_age=None, max_buffered=None):
+    """Start the background writer.
+
+    Arguments:
+    batch_size -- readings sent per batch (default config['sink_batch_size'])
+    max_age -- seconds before waiting readings are flushed (default config['sink_max_age'])
+    max_buffered -- buffer capacity in readings (default config['sink_max_buffered'])
+    """
+    if batch_size is None:
+      batch_size = config['sink_batch_size']
+    if max_age is None:
+      max_age = config['sink_max_age']
+    if max_buffered is None:
+      max_buffered = config['sink_max_buffered']
+    self._batch_size = batch_size
+    self._max_age = max_age
+    self._buffer = collections.deque(maxlen=max_buffered)
+    self._cond = threading.Condition()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+    atexit.register(self.close)
+
+  def write(self, readings):
+    """Queue SensorReadings for output.  Never blocks on the destination."""
+    now = time.time()
+    self._cond.acquire()
+    try:
+      overflow = len(self._buffer) + len(readings) - self._buffer.maxlen
+      if overflow > 0:
+        self._dropped_count += overflow
+      self._buffer.extend([(now, r) for r in readings])
+      self._max_depth = max(self._max_depth, len(self._buffer))
+      if len(self._buffer) >= self._batch_size:
+        self._cond.notify()
+    finally:
+      self._cond.release()
+
+  def flush(self, timeout=None):
+    """Send everything buffered now; wait (up to timeout seconds) until it has been sent."""
+    expires = timeout is not None and time.time() + timeout
+    self._cond.acquire()
+    try:
+      self._flush_requested = True
+      self._cond.notify_all()
+      while (self._buffer or self._in_flight) and self._thread.is_alive():
+        if expires and time.time() >= expires:
+          return False
+        self._cond.wait(0.1)
+      return True
+    finally:
+      self._cond.release()
+
+  def close(self, timeout=None):
+    """Flush buffered readings and stop the background writer."""
+    self._cond.acquire()
+    try:
+      self._closing = True
+      self._cond.notify_all()
+    finally:
+      self._cond.release()
+    self._thread.join(timeout)
+
+  def stats(self):
+    """Return a dict of buffer and throughput counters."""
+    self._cond.acquire()
+    try:
+      return {'buffered': len(self._buffer),
+              'max_buffered': self._max_depth,
+              'sent': self._sent_count,
+              'dropped': self._dropped_count,
+              'failed_batches': self._failed_batches,
+              'last_flush_latency': self._last_flush_latency}
+    finally:
+      self._cond.release()
+
+  def _next_batch(self):
+    """Wait for a batch to be ready and take it from the buffer.  Returns None once closed and empty."""
+    self._cond.acquire()
+    try:
+      while True:
+        if self._buffer and (self._closing or self._flush_requested
+                             or len(self._buffer) >= self._batch_size
+                             or time.time() - self._buffer[0][0] >= self._max_age):
+          n = min(self._batch_size, len(self._buffer))
+          batch = [self._buffer.popleft()[1] for i in range(n)]
+          self._in_flight = len(batch)
+          return batch
+        self._flush_requested = False
+        if self._closing:
+          return None
+        if self._buffer:
+          self._cond.wait(max(0.01, self._max_age - (time.time() - self._buffer[0][0])))
+        else:
+          self._cond.wait(self._max_age)
+    finally:
+      self._cond.release()
+
+  def _run(self):
+    retry_delay = 1
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+      while True:
+        start = time.time()
+        try:
+          self._send(batch)
+        except Exception, e:
+          print "%s error: %s" % (self.__class__.__name__, e)
+          self._failed_batches += 1
+          if self._closing and retry_delay > 8:
+            ## give up on what's left rather than hang shutdown forever
+            self._dropped_count += len(batch)
+            break
+          time.sleep(retry_delay)
+          retry_delay = min(retry_delay * 2, 60)
+          continue
+        retry_delay = 1
+        self._last_flush_latency = time.time() - start
+        self._sent_count += len(batch)
+        break
+      self._cond.acquire()
+      try:
+        self._in_flight = 0
+        self._cond.notify_all()
+      finally:
+        self._cond.release()
+
+  def _send(self, batch):
+    raise NotImplementedError
+
+class MySQLReadingSink(ReadingSink):
+  """Writes SensorReadings to the reading table (see the schema above) in batches.
+
+  Uses its own database connection, opened on first use and re-opened after 
+  an error, so database latency never holds up the connection used for 
+  configuration or the polling threads.
+  """
+
+  _connect_args = None
+  _dbh = None
+
+  def __init__(self, connect_args, **kwargs):
+    """Create the sink.
+
+    Arguments:
+    connect_args -- dict of keyword arguments for MySQLdb.connect()
+    
+    Other keyword arguments are passed to ReadingSink.
+    """
+    self._connect_args = connect_args
+    ReadingSink.__init__(self, **kwargs)
+
+  def _send(self, batch):
+    rows = []
+    for r in batch:
+      value = r.value()
+      if isinstance(value, (int, long, float)):
+        rows.append((r.display_name(), r.ts, value, None, r.condition()))
+      else:
+        rows.append((r.display_name(), r.ts, None, value, r.condition()))
+    try:
+      if self._dbh is None:
+        self._dbh = MySQLdb.connect(**self._connect_args)
+      c = self._dbh.cursor()
+      c.executemany("""INSERT INTO reading (name, ts, value, text_value, sensor_condition)
+                       VALUES (%s, %s, %s, %s, %s)""", rows)
+      c.close()
+      self._dbh.commit()
+    except MySQLdb.Error:
+      if self._dbh is not None:
+        try:
+          self._dbh.close()
+        except MySQLdb.Error:
+          pass
+      self._dbh = None
+      raise
+
+class StreamReadingSink(ReadingSink):
+  """Base class for sinks which write SensorReadings as lines of text to a TCP socket or a file.
+
+  Each batch goes out in a single write on a persistent connection (or open 
+  file).  Before a connection is reused it is checked for having been closed 
+  by the peer (a write to such a connection may appear to succeed), and if a 
+  write on a reused connection fails anyway the batch is sent again at once 
+  on a new one; failures beyond that are retried by ReadingSink.  A batch 
+  may therefore occasionally be delivered twice.
+
+  Subclasses implement _format(reading), which returns a line (including 
+  its newline), or None to leave the reading out.
+  """
+
+  _destination = None
+  """(host, port) tuple for a TCP destination, or a filename."""
+
+  _out = None
+  """The connected socket or open file (None until the first batch)."""
+
+  def __init__(self, destination, **kwargs):
+    """Create the sink.
+
+    Arguments:
+    destination -- (host, port) tuple to connect to, or the name of a file to append to
+
+    Other keyword arguments are passed to ReadingSink.
+    """
+    self._destination = destination
+    ReadingSink.__init__(self, **kwargs)
+
+  def close(self, timeout=None):
+    """Flush buffered readings, stop the background writer and close the connection or file."""
+    ReadingSink.close(self, timeout)
+    self._disconnect()
+
+  def _send(self, batch):
+    data = "".join([line for line in [self._format(r) for r in batch] if line is not None])
+    if not data:
+      return
+    while True:
+      if self._out is not None and isinstance(self._destination, tuple) and self._peer_closed():
+        self._disconnect()
+      fresh = self._out is None
+      if fresh:
+        self._connect()
+      try:
+        if isinstance(self._destination, tuple):
+          self._out.sendall(data)
+        else:
+          self._out.write(data)
+          self._out.flush()
+        return
+      except (socket.error, IOError):
+        self._disconnect()
+        if fresh:
+          raise
+
+  def _connect(self):
+    if isinstance(self._destination, tuple):
+      self._out = socket.create_connection(self._destination, config['connect_timeout'])
+      self._out.settimeout(config['read_timeout'])
+    else:
+      self._out = open(self._destination, "a")
+
+  def _peer_closed(self):
+    """Return True if the peer has closed (or reset) the connection.  Our peers never send us data."""
+    try:
+      if not select.select([self._out], [], [], 0)[0]:
+        return False
+      return self._out.recv(1) == ""
+    except socket.error:
+      return True
+
+  def _disconnect(self):
+    if self._out is not None:
+      try:
+        self._out.close()
+      except (socket.error, IOError):
+        pass
+      self._out = None
+
+  def _format(self, reading):
+    raise NotImplementedError
+
+_METRIC_UNSAFE = re.compile(r"[^\w\-]+")
+
+def _metric_name(reading, prefix):
+  """Return a reading's display name as a dot-free metric name (for Graphite and StatsD)."""
+  return prefix + _METRIC_UNSAFE.sub("_", reading.display_name()).strip("_")
+
+class GraphiteSink(StreamReadingSink):
+  """Sends numeric SensorReadings to Graphite (carbon) using the plaintext protocol.
+
+  Each reading becomes "<prefix><display name> <value> <timestamp>", with 
+  characters Graphite treats specially in the name replaced by "_".  
+  Non-numeric readings (e.g. "N/A") are left out.
+  """
+
+  _prefix = None
+
+  def __init__(self, destination, prefix="", **kwargs):
+    """Create the sink.
+
+    Arguments:
+    destination -- (host, port) of the carbon plaintext listener (usually port 2003), or a filename
+    prefix -- string prepended to every metric name (e.g. "netbotz.")
+
+    Other keyword arguments are passed to ReadingSink.
+    """
+    self._prefix = prefix
+    StreamReadingSink.__init__(self, destination, **kwargs)
+
+  def _format(self, reading):
+    value = reading.value()
+    if not isinstance(value, (int, long, float)):
+      return None
+    return "%s %s %d\n" % (_metric_name(reading, self._prefix), repr(float(value)), _epoch(reading.ts))
+
+class JSONLinesSink(StreamReadingSink):
+  """Writes SensorReadings as newline-delimited JSON objects.
+
+  Each line has the keys name (the display name), ts (ISO 8601), value and 
+  condition (null for readings without one).
+  """
+
+  def _format(self, reading):
+    return json.dumps({'name': reading.display_name(),
+                       'ts': reading.ts.isoformat(),
+                       'value': reading.value(),
+                       'condition': reading.condition()}) + "\n"
+
+class StatsdSink(ReadingSink):
+  """Sends numeric SensorReadings to StatsD as gauges over UDP.
+
+  Readings are packed several to a datagram (up to 
+  config['statsd_packet_size'] bytes), one "<name>:<value>|g" per line 
+  (a negative value is preceded by "<name>:0|g", as StatsD would otherwise 
+  take it as a change to the gauge).  StatsD has no notion of timestamps, so readings are reported as current 
+  when they arrive.  Non-numeric readings are left out.
+  """
+
+  _address = None
+  _prefix = None
+  _sock = None
+
+  def __init__(self, address, prefix="", **kwargs):
+    """Create the sink.
+
+    Arguments:
+    address -- (host, port) of the StatsD daemon (usually port 8125)
+    prefix -- string prepended to every metric name (e.g. "netbotz.")
+
+    Other keyword arguments are passed to ReadingSink.
+    """
+    self._address = address
+    self._prefix = prefix
+    ReadingSink.__init__(self, **kwargs)
+
+  def close(self, timeout=None):
+    """Flush buffered readings, stop the background writer and close the socket."""
+    ReadingSink.close(self, timeout)
+    if self._sock is not None:
+      self._sock.close()
+      self._sock = None
+
+  def _send(self, batch):
+    packets = []
+    for r in batch:
+      value = r.value()
+      if not isinstance(value, (int, long, float)):
+        continue
+      name = _metric_name(r, self._prefix)
+      value = repr(float(value))
+      line = "%s:%s|g" % (name, value)
+      if value.startswith("-"):
+        ## a signed gauge value is a delta; zero the gauge first to set it
+        line = "%s:0|g\n%s" % (name, line)
+      if packets and len(packets[-1]) + 1 + len(line) <= config['statsd_packet_size']:
+        packets[-1] += "\n" + line
+      else:
+        packets.append(line)
+
+    try:
+      if self._sock is None:
+        ## connect() so the address is resolved once rather than on every send
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect(self._address)
+      for p in packets:
+        self._sock.send(p)
+    except socket.error:
+      if self._sock is not None:
+        self._sock.close()
+      self._sock = None
+      raise
+
+####################################
+_CHECKPOINT_HEADER = struct.Struct("<8sII")
+"""Checkpoint file header: magic, record size and record count."""
+
+_CHECKPOINT_MAGIC = "PBZCKPT2"
+
+_CHECKPOINT_TEXT_SIZE = 64
+"""Longest text value a checkpoint record holds."""
+
+_CHECKPOINT_RECORD = struct.Struct("<IB3xddddH%ds" % _CHECKPOINT_TEXT_SIZE)
+"""Checkpoint record: sensor id, kind of reading (see _CHECKPOINT_NONE etc.), numeric value, 
+reading time, next check time, adaptive watch interval (0 if none), text value length and 
+text value."""
+
+(_CHECKPOINT_NONE, _CHECKPOINT_NUMBER, _CHECKPOINT_TEXT) = range(3)
+
+def write_checkpoint(path, states):
+  """Save sensor states to a checkpoint file for a warm restart (see Checkpoint).
+
+  Arguments:
+  path -- file to write; it is replaced atomically, so a crash mid-write 
+          leaves the previous checkpoint intact
+  states -- dict of sensor states keyed by sensor db id, as from 
+            CheckerPool.export_state() or ShardedCheckerPool.export_state()
+
+  A text reading too long for its record (over 64 bytes) is left out, so 
+  that sensor's schedule is restored but not its last reading.
+  """
+  records = []
+  for sensor_id in sorted(states.keys()):
+    (next_check, current, previous, watch_interval, last_observed) = states[sensor_id]
+    (kind, value, text, ts) = (_CHECKPOINT_NONE, 0.0, "", 0.0)
+    if current is not None:
+      if isinstance(current.value(), (int, long, float)):
+        (kind, value, ts) = (_CHECKPOINT_NUMBER, current.value(), _epoch(current.ts))
+      elif len(str(current.value())) <= _CHECKPOINT_TEXT_SIZE:
+        (kind, text, ts) = (_CHECKPOINT_TEXT, str(current.value()), _epoch(current.ts))
+      ## else restoring a truncated value would report a change on the next check
+    records.append(_CHECKPOINT_RECORD.pack(sensor_id, kind, value, ts, _epoch(next_check),
+                                           watch_interval or 0.0, len(text), text))
+  f = open(path + ".tmp", "wb")
+  try:
+    f.write(_CHECKPOINT_HEADER.pack(_CHECKPOINT_MAGIC, _CHECKPOINT_RECORD.size, len(records)))
+    f.write("".join(records))
+  finally:
+    f.close()
+  os.rename(path + ".tmp", path)
+
+def _checkpoint_state(record, sensor_name, display_prefix=None):
+  """Return the SensorChecker.export_state() tuple for a record returned by Checkpoint.get()."""
+  (next_check, value, ts, watch_interval) = record
+  current = None
+  if ts is not None:
+    current = SensorReading(ts, display_prefix)
+    current.set(sensor_name, value)
+  return (next_check, current, None, watch_interval, current)
+
+class Checkpoint:
+  """Read-only view of a checkpoint file written by write_checkpoint().
+
+  Public methods:
+  get(sensor_id)
+  close()
+
+  Records are fixed-size and sorted by sensor id, and the file is 
+  memory-mapped, so looking up a sensor is a binary search which touches 
+  only a few pages; a process restoring a few of the sensors reads only 
+  what it needs.
+  """
+
+  _file = None
+  _map = None
+  _count = 0
+
+  def __init__(self, path):
+    """Open and map the checkpoint file at path.  Raises ValueError if it isn't one."""
+    self._file = open(path, "rb")
+    try:
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):     ## an empty file can't be mapped
+      self._file.close()
+      raise ValueError("%s is not a checkpoint file" % path)
+    if len(self._map) < _CHECKPOINT_HEADER.size:
+      self.close()
+      raise ValueError("%s is not a checkpoint file" % path)
+    (magic, size, count) = _CHECKPOINT_HEADER.unpack_from(self._map, 0)
+    if (magic != _CHECKPOINT_MAGIC or size != _CHECKPOINT_RECORD.size
+        or len(self._map) < _CHECKPOINT_HEADER.size + count * size):
+      self.close()
+      raise ValueError("%s is not a checkpoint file" % path)
+    self._count = count
+
+  def __len__(self):
+    return self._count
+
+  def get(self, sensor_id):
+    """Return (next check time, reading value or None, reading time or None, watch interval or None)
+    for a sensor, or None if it isn't in the checkpoint."""
+    (lo, hi) = (0, self._count)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      record = _CHECKPOINT_RECORD.unpack_from(self._map, _CHECKPOINT_HEADER.size + mid * _CHECKPOINT_RECORD.size)
+      if record[0] < sensor_id:
+        lo = mid + 1
+      elif record[0] > sensor_id:
+        hi = mid
+      else:
+        (sensor_id, kind, value, ts, next_check, watch_interval, length, text) = record
+        if kind == _CHECKPOINT_NONE:
+          (value, ts) = (None, None)
+        else:
+          if kind == _CHECKPOINT_TEXT:
+            value = text[:length]
+          ts = datetime.fromtimestamp(ts)
+        return (datetime.fromtimestamp(next_check), value, ts, watch_interval or None)
+    return None
+
+  def close(self):
+    """Unmap and close the file."""
+    if self._map is not None:
+      self._map.close()
+    self._file.close()
+
+####################################
+_ARCHIVE_INDEX = struct.Struct("<dQII")
+"""Archive index record: page time (epoch seconds), data offset, compressed length (0 if 
+unchanged from the module's previous page) and module number."""
+
+class ArchiveWriter:
+  """Appends retrieved status pages to an archive for later replay (see ArchiveReader).
+
+  Public methods:
+  append()
+  close()
+
+  An archive at path is three files: path holds the zlib-compressed pages 
+  back to back, path.idx a fixed-size index record (_ARCHIVE_INDEX) for 
+  each page and path.modules the status page url of each module, one per 
+  line (a module's number is its line number).  A page identical to the 
+  module's previous one takes only an index record.  Appends are serialized
+  with a lock on the data file, so several processes (e.g. the workers of a 
+  ShardedCheckerPool) can share an archive.  The index record is written 
+  last, so a crash never leaves an index entry without its page.
+  """
+
+  _path = None
+  _data = None
+  _index = None
+  _modules_file = None
+
+  _modules = None
+  """Dict mapping module url to module number."""
+
+  _last_digest = None
+  """Dict mapping module number to the digest of its last archived page."""
+
+  _lock = None
+
+  def __init__(self, path):
+    """Open (or create) the archive at path for appending."""
+    self._path = path
+    self._data = open(path, "ab")
+    self._index = open(path + ".idx", "ab")
+    self._modules_file = open(path + ".modules", "a+")
+    self._modules_file.seek(0)
+    self._modules = dict([(url, i) for (i, url) in enumerate(self._modules_file.read().splitlines())])
+    self._last_digest = {}
+    self._lock = threading.Lock()
+
+  def append(self, url, ts, html, digest=None):
+    """Add a page to the archive.
+
+    Arguments:
+    url -- the module's status page url
+    ts -- datetime the page was retrieved
+    html -- the page, or None if only its digest is known (e.g. after a 304); 
+            such pages are recorded only if unchanged since the last one archived
+    digest -- sha1 digest of the page (computed if not given)
+    """
+    if digest is None and html is not None:
+      digest = hashlib.sha1(html).digest()
+    self._lock.acquire()
+    fcntl.flock(self._data, fcntl.LOCK_EX)
+    try:
+      if url not in self._modules:
+        self._load_modules()
+      if url not in self._modules:
+        self._modules[url] = len(self._modules)
+        self._modules_file.write(url + "\n")
+        self._modules_file.flush()
+      module = self._modules[url]
+
+      if digest is not None and digest == self._last_digest.get(module):
+        (offset, length) = (0, 0)
+      elif html is None:
+        return
+      else:
+        page = zlib.compress(html)
+        self._data.seek(0, 2)
+        offset = self._data.tell()
+        self._data.write(page)
+        self._data.flush()
+        length = len(page)
+      self._last_digest[module] = digest
+      self._index.write(_ARCHIVE_INDEX.pack(_epoch(ts), offset, length, module))
+      self._index.flush()
+    finally:
+      fcntl.flock(self._data, fcntl.LOCK_UN)
+      self._lock.release()
+
+  def close(self):
+    """Close the archive files."""
+    for f in (self._data, self._index, self._modules_file):
+      f.close()
+
+  def _load_modules(self):
+    """Pick up modules added by other processes.  Caller holds the lock."""
+    self._modules_file.seek(0)
+    for (i, url) in enumerate(self._modules_file.read().splitlines()):
+      self._modules.setdefault(url, i)
+
+_archive_writers = {}
+"""ArchiveWriters keyed by (path, process id)."""
+
+_archive_writers_lock = threading.Lock()
+
+def get_archive_writer(path):
+  """Return this process's ArchiveWriter for the archive at path, opening it if necessary."""
+  _archive_writers_lock.acquire()
+  try:
+    ## a forked child mustn't share its parent's files (or file locks)
+    writer = _archive_writers.get((path, os.getpid()))
+    if writer is None:
+      writer = ArchiveWriter(path)
+      _archive_writers[(path, os.getpid())] = writer
+    return writer
+  finally:
+    _archive_writers_lock.release()
+
+class ArchiveReader:
+  """Reads the pages of an archive written by ArchiveWriter, and replays them through a CheckerPool.
+
+  Public methods:
+  modules()
+  pages()
+  replay()
+  """
+
+  _path = None
+  _modules = None
+  _index = None
+  """List of (time, data offset, length, module number) index records."""
+
+  def __init__(self, path):
+    """Open the archive at path, reading its index."""
+    self._path = path
+    self._modules = open(path + ".modules").read().splitlines()
+    raw = open(path + ".idx", "rb").read()
+    raw = raw[:len(raw) - len(raw) % _ARCHIVE_INDEX.size]   ## ignore a half-written record
+    self._index = [_ARCHIVE_INDEX.unpack_from(raw, n) for n in range(0, len(raw), _ARCHIVE_INDEX.size)]
+
+  def modules(self):
+    """Return the status page urls of the archived modules."""
+    return list(self._modules)
+
+  def pages(self, modules=None, start=None, end=None):
+    """Yield (url, datetime, html) for archived pages in time order.
+
+    Arguments:
+    modules -- optional list of module urls to restrict the pages to
+    start, end -- optional datetimes bounding the pages (inclusive)
+
+    Unchanged pages are yielded as the same string object as the module's 
+    previous page.
+    """
+    wanted = None
+    if modules is not None:
+      wanted = set([self._modules.index(url) for url in modules if url in self._modules])
+    lo = start is not None and _epoch(start)
+    hi = end is not None and _epoch(end)
+
+    last_full = {}
+    """Module number -> (offset, length) of its last stored page."""
+
+    html = {}
+    data = open(self._path, "rb")
+    try:
+      for (ts, offset, length, module) in sorted(self._index, key=lambda rec: rec[0]):
+        if wanted is not None and module not in wanted:
+          continue
+        if length:
+          last_full[module] = (offset, length)
+        if (lo and ts < lo) or (hi and ts > hi) or module not in last_full:
+          continue
+        if length or module not in html:
+          (offset, length) = last_full[module]
+          data.seek(offset)
+          html[module] = zlib.decompress(data.read(length))
+        yield (self._modules[module], datetime.fromtimestamp(ts), html[module])
+    finally:
+      data.close()
+
+  def replay(self, pool, handler, start=None, end=None):
+    """Feed archived pages through the parsing and evaluation of a CheckerPool's modules.
+
+    Arguments:
+    pool -- CheckerPool (its sensors' state is changed as if the pages had just been polled)
+    handler -- callable taking each list of alerting SensorReadings
+    start, end -- optional datetimes bounding the pages replayed
+
+    Sensor schedules are judged against the archived times, and each 
+    sensor starts out due at the first page replayed.  Pages of modules not 
+    in the pool are skipped.  Returns the number of pages replayed.
+    """
+    by_url = dict([(smc.url(), smc) for smc in pool.modules()])
+    started = set()
+    n = 0
+    for (url, ts, html) in self.pages(by_url.keys(), start, end):
+      smc = by_url[url]
+      if url not in started:
+        started.add(url)
+        for s in smc.sensors():
+          s.reschedule(ts)
+      alerts = smc.replay_page(html, ts)
+      if alerts:
+        handler(alerts)
+      n += 1
+    return n
+
+####################################
+class LatestValueIndex:
+  """In-memory index of the latest reading of every sensor polled, so current values can be read without touching the appliances.
+
+  Public methods:
+  update(host, module_name, display_name, readings)
+  merge(entries)
+  retain(modules)
+  take_updates()
+  query(host=None, module=None, sensor=None, max_age=None)
+
+  Entries are (host, module name, display name, NBSensorReading) tuples 
+  keyed by (host, module name, sensor name), one per sensor on every page 
+  parsed (tracked or not).  They are grouped by host, so a query for one 
+  host looks only at that host's sensors.  An index created with 
+  record_updates=True also remembers which entries changed since the last 
+  take_updates(), so a ShardedCheckerPool worker can forward them to the 
+  parent's index.
+  """
+
+  _hosts = None
+  """Dict mapping host (without the scheme) to a dict of entries keyed by (module name, sensor name)."""
+
+  _updates = None
+  """Dict of entries updated since the last take_updates(), if recording updates."""
+
+  _lock = None
+
+  def __init__(self, record_updates=False):
+    self._hosts = {}
+    self._lock = threading.Lock()
+    if record_updates:
+      self._updates = {}
+
+  def __len__(self):
+    return sum([len(entries) for entries in self._hosts.itervalues()])
+
+  def update(self, host, module_name, display_name, readings):
+    """Record the readings just parsed from a module's page."""
+    host = re.sub(r"^\w+://", "", host)
+    self._lock.acquire()
+    try:
+      entries = self._hosts.setdefault(host, {})
+      for r in readings:
+        entry = (host, module_name, display_name, r)
+        entries[(module_name, r.key())] = entry
+        if self._updates is not None:
+          self._updates[(host, module_name, r.key())] = entry
+    finally:
+      self._lock.release()
+
+  def merge(self, entries):
+    """Add entries from another index (see take_updates())."""
+    self._lock.acquire()
+    try:
+      for entry in entries:
+        (host, module_name, display_name, r) = entry
+        self._hosts.setdefault(host, {})[(module_name, r.key())] = entry
+    finally:
+      self._lock.release()
+
+  def retain(self, modules):
+    """Drop the entries of every module not in modules, a list of (host, module name) pairs.
+
+    Called when the modules polled change, so that readings of modules no 
+    longer polled aren't served forever.  (Every sensor on a polled page is 
+    kept up to date, tracked or not, so entries are only dropped by module.)
+    """
+    keep = set([(re.sub(r"^\w+://", "", host), module_name) for (host, module_name) in modules])
+    self._lock.acquire()
+    try:
+      for host in self._hosts.keys():
+        entries = self._hosts[host]
+        for key in [key for key in entries if (host, key[0]) not in keep]:
+          del entries[key]
+        if not entries:
+          del self._hosts[host]
+    finally:
+      self._lock.release()
+
+  def take_updates(self):
+    """Return the list of entries updated since the last call."""
+    self._lock.acquire()
+    try:
+      (updates, self._updates) = (self._updates.values(), {})
+    finally:
+      self._lock.release()
+    return updates
+
+  def query(self, host=None, module=None, sensor=None, max_age=None):
+    """Return the matching entries, sorted by host, module and sensor.
+
+    Arguments:
+    host -- only this host (address, as in the config db)
+    module -- only modules with this module name or display name
+    sensor -- only sensors with this name
+    max_age -- only readings taken in the last max_age seconds
+    """
+    cutoff = None
+    if max_age is not None:
+      cutoff = datetime.now() - timedelta(0, max_age)
+    self._lock.acquire()
+    try:
+      if host is None:
+        groups = self._hosts.values()
+      else:
+        groups = [self._hosts.get(re.sub(r"^\w+://", "", host), {})]
+      r = []
+      for entries in groups:
+        for entry in entries.itervalues():
+          if module is not None and module != entry[1] and module != entry[2]:
+            continue
+          if sensor is not None and sensor != entry[3].key():
+            continue
+          if cutoff is not None and entry[3].ts < cutoff:
+            continue
+          r.append(entry)
+    finally:
+      self._lock.release()
+    r.sort(key=lambda entry: (entry[0], entry[1], entry[3].key()))
+    return r
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class _LatestValueHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers GET /readings for a LatestValueServer."""
+
+  def do_GET(self):
+    url = urlparse.urlparse(self.path)
+    if url.path != "/readings":
+      self._reply(404, {'error': "not found; try /readings"})
+      return
+    args = dict([(k, v[-1]) for (k, v) in urlparse.parse_qs(url.query).iteritems()])
+    max_age = args.get('max_age')
+    try:
+      if max_age is not None:
+        max_age = float(max_age)
+    except ValueError:
+      self._reply(400, {'error': "max_age must be a number of seconds"})
+      return
+    try:
+      self._reply(200, {'readings': self._readings(args, max_age)})
+    except Exception, e:
+      _log.exception("Error answering %s", self.path)
+      self._reply(500, {'error': str(e)})
+
+  def _readings(self, args, max_age):
+    now = datetime.now()
+    readings = []
+    for (host, module_name, display_name, r) in self.server.index.query(args.get('host'), args.get('module'),
+                                                                        args.get('sensor'), max_age):
+      readings.append({'host': host,
+                       'module': module_name,
+                       'display_name': display_name,
+                       'sensor': r.key(),
+                       'value': r.value(),
+                       'unit': r.unit_string().strip(),
+                       'condition': r.condition(),
+                       'ts': r.ts.isoformat(),
+                       'age': _total_seconds(now - r.ts)})
+    return readings
+
+  def _reply(self, status, body):
+    ## names and text values are byte strings in whatever charset the db and 
+    ## appliances use; latin-1 maps every byte to a character, as for the 
+    ## config snapshot
+    body = json.dumps(body, encoding="latin-1")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    _log.debug("%s %s", self.address_string(), format % args)
+
+class LatestValueServer:
+  """Serves a LatestValueIndex as read-only JSON over HTTP, from background threads.
+
+  Public methods:
+  address()
+  close()
+
+  GET /readings returns {"readings": [...]}, one object per entry with the 
+  keys host, module, display_name, sensor, value, unit, condition, ts (ISO 
+  8601) and age (seconds).  The query parameters host, module (name or 
+  display name) and sensor filter the entries, and max_age (seconds) leaves 
+  out readings older than that.  For example:
+
+    curl 'http://localhost:8080/readings?module=Rack12&sensor=Temperature&max_age=300'
+  """
+
+  _server = None
+  _thread = None
+
+  def __init__(self, index, address=("127.0.0.1", 8080)):
+    """Start serving.
+
+    Arguments:
+    index -- the LatestValueIndex to serve
+    address -- (host, port) to listen on; port 0 picks a free port (see address())
+    """
+    self._server = _ThreadingHTTPServer(address, _LatestValueHandler)
+    self._server.index = index
+    self._thread = threading.Thread(target=self._server.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+    atexit.register(self.close)
+
+  def address(self):
+    """Return the (host, port) the server is listening on."""
+    return self._server.server_address
+
+  def close(self):
+    """Stop serving."""
+    if self._thread is not None:
+      self._server.shutdown()
+      self._server.server_close()
+      self._thread = None
+
+####################################
+class PollingDaemon:
+  """Polls the configured sensors until told to stop, sending alerting readings to sinks.
+
+  Public methods:
+  run()
+  reload()
+  stop()
+
+  Between cycles the daemon sleeps until the next module deadline (see 
+  Scheduler), so sensors are fetched neither more often nor later than 
+  necessary.  Every config['reload_interval'] seconds, and on SIGHUP, the 
+  sensor configuration is checked for changes (see config_fingerprint()) and 
+  any are applied, keeping each sensor's schedule and last readings.  SIGTERM
+  (or SIGINT) finishes the cycle under way, flushes the sinks and exits.  
+  Signals only set flags which the loop acts on, so a signal never 
+  interrupts a cycle midway.
+
+  If config['checkpoint'] is set, sensor state is saved there every 
+  config['checkpoint_interval'] seconds and on exit, and restored at start, 
+  so a restart neither polls every sensor at once nor repeats the last 
+  readings as changes.
+
+  The config is read from the db in a background thread and applied by the 
+  loop between cycles, so a slow or unreachable db never holds up polling.
+
+  If config['config_snapshot'] is set and the file exists, polling starts 
+  from the config saved there without waiting for the db, which is then 
+  caught up with at once (retrying every config['reconcile_retry_interval'] 
+  seconds while the db can't be reached).  The snapshot is rewritten 
+  whenever a reload changes the config, so polling carries on through db 
+  outages, and through restarts during them.
+  """
+
+  _dbh_factory = None
+  _sinks = None
+  _shards = None
+  _max_concurrency = None
+  _max_per_host = None
+  _index = None
+
+  _scheduler = None
+  """Scheduler (or ShardedCheckerPool) deciding which modules to poll when."""
+
+  _pool = None
+  _fingerprint = None
+  """config_fingerprint() of the config the pool was loaded from."""
+
+  _reloader = None
+  """Thread reading the config from the db, while one is."""
+
+  _new_config = None
+  """(pool config, fingerprint) read by the reloader for the loop to apply."""
+
+  _catching_up = False
+  """True from a start from the config snapshot until the db has been read."""
+
+  _next_reload = None
+  """time.time() of the next config check (None if only on SIGHUP)."""
+
+  _next_checkpoint = None
+  _reload_requested = False
+  _stop_requested = False
+
+  def __init__(self, dbh_factory, sinks=None, shards=1, max_concurrency=None, max_per_host=None, index=None):
+    """Load the sensor configuration and get ready to poll.
+
+    Arguments:
+    dbh_factory -- callable returning a connected database handle to the sensor config db
+    sinks -- list of ReadingSinks to write alerting readings to (default: log them)
+    shards -- worker processes to poll from; 1 polls from this process
+    max_concurrency -- modules polled at once (default config['max_concurrency'])
+    max_per_host -- modules on one host polled at once (default config['max_per_host'])
+    index -- optional LatestValueIndex to keep the latest reading of every sensor in
+    """
+    self._dbh_factory = dbh_factory
+    self._index = index
+    self._sinks = sinks or []
+    self._shards = shards
+    self._max_concurrency = max_concurrency
+    self._max_per_host = max_per_host
+    checkpoint = config['checkpoint']
+    if checkpoint is not None and not os.path.exists(checkpoint):
+      checkpoint = None
+    snapshot = config['config_snapshot']
+    self._schedule_reload()
+    if snapshot is not None and os.path.exists(snapshot):
+      _log.info("Starting from the config snapshot in %s", snapshot)
+      dbh = None
+    else:
+      dbh = self._dbh_factory()
+    try:
+      if shards > 1:
+        if dbh is None:
+          (pool_config, self._fingerprint) = load_config_snapshot(snapshot)
+        else:
+          self._fingerprint = config_fingerprint(dbh)
+          pool_config = load_pool_config(dbh)
+          self._save_snapshot(pool_config, self._fingerprint)
+        self._start_shards(pool_config, None, checkpoint)
+      else:
+        self._pool = CheckerPool(dbh, max_concurrency, max_per_host, snapshot=snapshot, index=index)
+        if checkpoint is not None:
+          c = Checkpoint(checkpoint)
+          try:
+            self._pool.restore_checkpoint(c)
+          finally:
+            c.close()
+        self._fingerprint = self._pool.fingerprint()
+        self._scheduler = Scheduler(self._pool)
+        _log.info("Polling %d modules", len(self._pool.modules()))
+    finally:
+      if dbh is not None:
+        dbh.close()
+    if checkpoint is not None:
+      _log.info("Restored sensor state from %s", checkpoint)
+    if dbh is None:
+      self._catching_up = True
+      self._reload_requested = True       ## catch up with the db as soon as it can be reached
+    self._next_checkpoint = time.time() + config['checkpoint_interval']
+
+  def _start_shards(self, pool_config, states, checkpoint=None):
+    self._pool = ShardedCheckerPool(None, self._shards, self._max_concurrency, self._max_per_host,
+                                    pool_config, states, checkpoint, self._index)
+    self._scheduler = self._pool
+    _log.info("Polling %d modules from %d processes", len(pool_config), self._shards)
+
+  def _stop_pool(self):
+    """Stop the current pool; return its sensor states."""
+    if isinstance(self._pool, ShardedCheckerPool):
+      self._pool.close()
+    return self._pool.export_state()
+
+  def _schedule_reload(self):
+    if config['reload_interval']:
+      self._next_reload = time.time() + config['reload_interval']
+    else:
+      self._next_reload = None
+
+  def reload(self):
+    """Start checking the sensor configuration for changes, unless a check is already under way.
+
+    The db is read from a background thread; a changed config is applied by 
+    the loop once it has been read (see _apply_new_config()).  If the 
+    database can't be reached, polling continues with the old configuration.
+    """
+    self._schedule_reload()
+    if self._reloader is not None and self._reloader.is_alive():
+      return
+    self._reloader = threading.Thread(target=self._read_config, args=(self._fingerprint,))
+    self._reloader.daemon = True
+    self._reloader.start()
+
+  def _read_config(self, fingerprint):
+    """Read the config from the db if its fingerprint differs from the one given, for the loop to apply."""
+    try:
+      dbh = self._dbh_factory()
+      try:
+        new_fingerprint = config_fingerprint(dbh)
+        if new_fingerprint != fingerprint:
+          self._new_config = (load_pool_config(dbh), new_fingerprint)
+      finally:
+        dbh.close()
+      self._catching_up = False
+    except MySQLdb.Error, e:
+      if self._catching_up:
+        _log.warning("Config db unreachable, retrying in %d s: %s", config['reconcile_retry_interval'], e)
+        retry = time.time() + config['reconcile_retry_interval']
+        if self._next_reload is None or retry < self._next_reload:
+          self._next_reload = retry
+      else:
+        _log.error("Config reload failed, keeping the current config: %s", e)
+
+  def _apply_new_config(self):
+    """Apply the config read by the reloader, keeping the state of sensors which are still configured.
+
+    A single-process pool is changed in place (see CheckerPool.apply_config()); 
+    sharded workers are restarted with the new configuration.
+    """
+    ((pool_config, fingerprint), self._new_config) = (self._new_config, None)
+    self._fingerprint = fingerprint
+    if isinstance(self._pool, CheckerPool):
+      if self._pool.apply_config(pool_config, fingerprint):
+        _log.info("Sensor config changed; now polling %d modules", len(self._pool.modules()))
+      return
+    self._save_snapshot(pool_config, fingerprint)
+    self._start_shards(pool_config, self._stop_pool())
+    _log.info("Sensor config changed; now polling %d modules", len(pool_config))
+
+  def _save_snapshot(self, pool_config, fingerprint):
+    if config['config_snapshot'] is None:
+      return
+    try:
+      save_config_snapshot(config['config_snapshot'], pool_config, fingerprint)
+    except (IOError, OSError), e:
+      _log.error("Config snapshot failed: %s", e)
+
+  def _write_checkpoint(self, states):
+    self._next_checkpoint = time.time() + config['checkpoint_interval']
+    try:
+      write_checkpoint(config['checkpoint'], states)
+    except (IOError, OSError), e:
+      _log.error("Checkpoint failed: %s", e)
+
+  def stop(self):
+    """Ask the loop to exit once the cycle under way is done (safe to call from a signal handler)."""
+    self._stop_requested = True
+
+  def _request_reload(self, signum, frame):
+    self._reload_requested = True
+
+  def _request_stop(self, signum, frame):
+    self.stop()
+
+  def run(self):
+    """Poll until stop() is called (or SIGTERM/SIGINT arrives); then flush and close the sinks."""
+    signal.signal(signal.SIGHUP, self._request_reload)
+    signal.signal(signal.SIGTERM, self._request_stop)
+    signal.signal(signal.SIGINT, self._request_stop)
+    try:
+      while not self._stop_requested:
+        if self._new_config is not None:
+          self._apply_new_config()
+        if self._reload_requested or (self._next_reload is not None and time.time() >= self._next_reload):
+          if self._reload_requested:
+            _log.info("Reloading sensor config")
+          self._reload_requested = False
+          self.reload()
+        if config['checkpoint'] and time.time() >= self._next_checkpoint:
+          self._write_checkpoint(self._pool.export_state())
+
+        deadline = self._scheduler.next_deadline()
+        now = datetime.now()
+        if deadline is None or deadline > now:
+          if deadline is None:
+            delay = config['threshold_poll_interval']
+          else:
+            delay = _total_seconds(deadline - now)
+          if self._next_reload is not None:
+            delay = min(delay, max(0, self._next_reload - time.time()))
+          if self._reloader is not None and self._reloader.is_alive():
+            delay = min(delay, 1)         ## apply the new config soon after it has been read
+          if config['checkpoint']:
+            delay = min(delay, max(0, self._next_checkpoint - time.time()))
+          ## time.sleep() returns early when a signal arrives, so SIGHUP/SIGTERM act promptly
+          time.sleep(delay)
+          continue
+
+        start = time.time()
+        alerts = self._scheduler.run_pending()
+        for sink in self._sinks:
+          sink.write(alerts)
+        if not self._sinks:
+          for r in alerts:
+            _log.info("%s", r)
+        _log.debug("Cycle: %d readings in %.3f s, started %.3f s after the deadline",
+                    len(alerts), time.time() - start, _total_seconds(now - deadline))
+    finally:
+      _log.info("Stopping")
+      states = self._stop_pool()
+      if config['checkpoint']:
+        self._write_checkpoint(states)
+      for sink in self._sinks:
+        sink.close(config['request_timeout'])
+
+def _address(s, default_port):
+  """Split a "host[:port]" string into a (host, port) tuple."""
+  (host, sep, port) = s.partition(":")
+  return (host, int(port or default_port))
+
+def _parse_time(s):
+  """Parse a "YYYY-MM-DD HH:MM:SS" command line argument."""
+  return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
+
+def main(argv=None):
+  """Run pybotz as a polling daemon; see --help."""
+  parser = argparse.ArgumentParser(description="Poll Netbotz appliances, sending changed readings to sinks.")
+  parser.add_argument("--db-host", default="localhost", help="MySQL host of the sensordata db")
+  parser.add_argument("--db-user", help="MySQL user")
+  parser.add_argument("--db-password", help="MySQL password (better kept in --db-defaults-file)")
+  parser.add_argument("--db-name", default="sensordata", help="MySQL database name")
+  parser.add_argument("--db-defaults-file", help="MySQL option file with connection settings")
+  parser.add_argument("--graphite", metavar="HOST[:PORT]", help="send readings to carbon's plaintext port")
+  parser.add_argument("--graphite-prefix", default="", help="prefix for Graphite and StatsD metric names")
+  parser.add_argument("--statsd", metavar="HOST[:PORT]", help="send readings to StatsD as gauges")
+  parser.add_argument("--jsonl", metavar="FILE|HOST:PORT", help="write readings as JSON lines")
+  parser.add_argument("--store-readings", action="store_true",
+                      help="write readings to the reading table of the sensordata db")
+  parser.add_argument("--shards", type=int, default=1, help="worker processes to poll from")
+  parser.add_argument("--concurrency", type=int, default=config['max_concurrency'],
+                      help="modules polled at once")
+  parser.add_argument("--per-host", type=int, default=config['max_per_host'],
+                      help="modules polled at once on any one host")
+  parser.add_argument("--parser", choices=["fast", "soup"], default=config['parser'])
+  parser.add_argument("--pipeline", action="store_true",
+                      help="overlap fetching, parsing and evaluation in separate stages")
+  parser.add_argument("--archive", metavar="PATH", help="record every retrieved page in an archive")
+  parser.add_argument("--replay", metavar="PATH",
+                      help="instead of polling, replay an archive through the sensor config and exit")
+  parser.add_argument("--replay-start", type=_parse_time, metavar="'YYYY-MM-DD HH:MM:SS'",
+                      help="replay only pages retrieved from this time")
+  parser.add_argument("--replay-end", type=_parse_time, metavar="'YYYY-MM-DD HH:MM:SS'",
+                      help="replay only pages retrieved until this time")
+  parser.add_argument("--checkpoint", metavar="PATH",
+                      help="keep sensor state in a checkpoint file, to resume from on restart")
+  parser.add_argument("--config-snapshot", metavar="PATH",
+                      help="keep a local copy of the sensor config, to start from without the db")
+  parser.add_argument("--http", metavar="[HOST:]PORT",
+                      help="serve the latest reading of every sensor as JSON (GET /readings)")
+  parser.add_argument("--log-level", default="INFO", help="DEBUG logs the timing of every cycle")
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                      format="%(asctime)s %(levelname)s %(message)s")
+  config['parser'] = args.parser
+  config['pipeline'] = args.pipeline
+  config['archive'] = args.archive
+  config['checkpoint'] = args.checkpoint
+  config['config_snapshot'] = args.config_snapshot
+
+  connect_args = {'host': args.db_host, 'db': args.db_name, 'connect_timeout': config['db_connect_timeout']}
+  if args.db_user:
+    connect_args['user'] = args.db_user
+  if args.db_password:
+    connect_args['passwd'] = args.db_password
+  if args.db_defaults_file:
+    connect_args['read_default_file'] = args.db_defaults_file
+
+  sinks = []
+  if args.graphite:
+    sinks.append(GraphiteSink(_address(args.graphite, 2003), args.graphite_prefix))
+  if args.statsd:
+    sinks.append(StatsdSink(_address(args.statsd, 8125), args.graphite_prefix))
+  if args.jsonl:
+    if re.match(r"[^/]+:\d+$", args.jsonl):
+      sinks.append(JSONLinesSink(_address(args.jsonl, None)))
+    else:
+      sinks.append(JSONLinesSink(args.jsonl))
+  if args.store_readings:
+    sinks.append(MySQLReadingSink(connect_args))
+
+  if args.replay:
+    dbh = MySQLdb.connect(**connect_args)
+    pool = CheckerPool(dbh)
+    dbh.close()
+    def handler(alerts):
+      for sink in sinks:
+        sink.write(alerts)
+      if not sinks:
+        for r in alerts:
+          _log.info("%s", r)
+    start = time.time()
+    n = ArchiveReader(args.replay).replay(pool, handler, args.replay_start, args.replay_end)
+    for sink in sinks:
+      sink.close()
+    _log.info("Replayed %d pages in %.3f s", n, time.time() - start)
+    return 0
+
+  index = None
+  if args.http:
+    index = LatestValueIndex()
+    if ":" not in args.http:
+      args.http = "127.0.0.1:" + args.http
+    server = LatestValueServer(index, _address(args.http, None))
+    _log.info("Serving latest readings on http://%s:%d/readings", *server.address())
+  daemon = PollingDaemon(lambda: MySQLdb.connect(**connect_args), sinks, args.shards,
+                         args.concurrency, args.per_host, index)
+  daemon.run()
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())